@@ -2,42 +2,126 @@ import asyncio
 import logging
 import json
 from telethon import TelegramClient, events, errors
+from telethon.network import ConnectionTcpFull
 from telethon.tl.types import (
     MessageMediaWebPage, MessageEntityTextUrl, MessageEntityUrl,
     MessageMediaPhoto, MessageMediaDocument, MessageMediaPoll,
     MessageMediaGeo, MessageMediaContact, MessageMediaVenue,
     MessageMediaGame, MessageMediaInvoice, MessageMediaGeoLive,
     MessageMediaDice, MessageMediaStory, InputMediaPoll, Poll,
-    PollAnswer, InputReplyToMessage, Updates, UpdateNewMessage
+    PollAnswer, InputReplyToMessage, Updates, UpdateNewMessage,
+    MessageEntityMentionName, InputMessageEntityMentionName,
+    MessageEntityEmail, MessageEntityMention, MessageEntityHashtag, MessageEntityCashtag,
+    MessageEntityBotCommand, MessageEntityPhone, PhotoSize, PhotoCachedSize, PhotoSizeProgressive
 )
 from collections import deque
-from datetime import datetime
+from datetime import datetime, timedelta
 import imagehash
+import numpy as np
 from PIL import Image
 import io
 import traceback
 import re
 import shutil
+import os
+import tempfile
+import threading
+import bisect
+import unicodedata
+import copy
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict
+import time
 import ahocorasick  # Requires: pip install pyahocorasick
 
 # Configuration
 API_ID = 23617139    # Replace with your API ID
 API_HASH = "5bfc582b080fa09a1a2eaa6ee60fd5d4"  # Replace with your API hash
 SESSION_FILE = "userbot_session"
-client = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+
+class ConnectionWithEvents(ConnectionTcpFull):
+    """Telethon's default connection, reporting when the client's main connection goes up or down.
+
+    Telethon's sender reconnects by disconnecting and connecting the same
+    connection object again, so every reconnect passes through here as well.
+    The main connection is told apart from connections to other data centers
+    (e.g. for downloads) through the private client._sender._connection.
+    connect() reports as soon as the TCP connection is up, before the sender's
+    loops and auth key are ready. Requests made in between wait in the sender's
+    queue on a reconnect, but fail with ConnectionError (and are retried) on
+    the first connect.
+    """
+
+    async def connect(self, *args, **kwargs):
+        await super().connect(*args, **kwargs)
+        if client._sender._connection is self:
+            on_connection_change(True)
+
+    async def disconnect(self):
+        if client._sender._connection is self:
+            on_connection_change(False)
+        await super().disconnect()
+
+client = TelegramClient(SESSION_FILE, API_ID, API_HASH, connection=ConnectionWithEvents)
+# Extra accounts that share the sending load. Each must be a member of the source and destination
+# chats of the pairs it may serve; updates and commands are only handled by the main client.
+SESSION_POOL_FILES = []
+pool_clients = {SESSION_FILE: client}
+pool_clients.update((session, TelegramClient(session, API_ID, API_HASH)) for session in SESSION_POOL_FILES)
 
 MAPPINGS_FILE = "channel_mappings.json"
+MAPPINGS_SAVE_DELAY = 1.0  # seconds to coalesce mapping changes into one write
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
 MAX_QUEUE_SIZE = 100
-MAX_MAPPING_HISTORY = 1000
+QUEUE_LOG_FILE = "queue.log"  # Append-only log of queued jobs, replayed on startup
+QUEUE_LOG_COMPACT_AT = 10000  # Acknowledged records before the queue log is rewritten
+MESSAGE_STORE_FILE = "forwarded_messages.db"
+MESSAGE_CACHE_SIZE = 20000  # Hot LRU entries kept in front of the message store
+MESSAGE_STORE_FLUSH_INTERVAL = 1  # seconds between batched message store writes
+MESSAGE_RETENTION_DAYS = 30  # Forwarded message mappings older than this are pruned
+MESSAGE_STORE_MAX_ROWS = 2000000  # Oldest mappings beyond this count are pruned
+STATS_FLUSH_INTERVAL = 60  # seconds between pair stats flushes to the message store
+STATS_HISTORY_DAYS = 90  # Hourly pair stats kept for /stathistory
+IMAGE_HASH_CACHE_SIZE = 5000  # Photo hashes kept in memory
+IMAGE_HASH_STORE_MAX_ROWS = 200000  # Oldest cached photo hashes beyond this count are pruned
+BACKFILL_MAP_LIMIT = 1000  # Max history messages per side scanned by /backfillmap
+BACKFILL_MAP_WINDOW = 20  # Destination messages searched ahead for each source message
 MONITOR_CHAT_ID = None
 NOTIFY_CHAT_ID = None
 INACTIVITY_THRESHOLD = 21600  # 6 hours in seconds
-MAX_MESSAGE_LENGTH = 4096  # Telegram's max message length
-FORWARD_DELAY = 1  # seconds delay between forwarding messages
+MAX_MESSAGE_LENGTH = 4096  # Telegram's max message length, in UTF-16 code units
+MAX_CAPTION_LENGTH = 1024  # Telegram's max media caption length, in UTF-16 code units
+DEFAULT_IMAGE_HASH_THRESHOLD = 6  # Max pHash Hamming distance (of 64 bits) treated as the same image
+IMAGE_HASH_EXECUTOR = "thread"  # "thread" or "process" pool for image decoding and pHash
+IMAGE_HASH_WORKERS = 2  # Image hashing pool size
+IMAGE_HASH_MAX_INFLIGHT = 4  # Max images being decoded/hashed at once
+IMAGE_HASH_MIN_THUMB = 64  # Smallest thumbnail side (px) used for pHash; pHash itself works on 32x32
+IMAGE_HASH_SOURCE = "thumb"  # What blocked image hashes are taken from; older pairs hashed full-size images
+ALBUM_WINDOW = 1.0  # seconds to wait for the rest of an album (grouped_id) before forwarding it
+ALBUM_MAX_SIZE = 10  # Telegram's max media group size
+NATIVE_FORWARD_BATCH = 100  # Max message IDs per native forward request
+DELETE_BATCH_SIZE = 100  # Max message IDs per delete request
+EDIT_DEBOUNCE = 2.0  # seconds to collect a burst of edits to one message; only the last version is sent
+EDIT_DEBOUNCE_MAX = 10.0  # longest a continuing burst of edits may hold back the latest version
+LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag samples
+DESTINATION_RATE = 1.0  # Sustained messages per second to a single chat
+DESTINATION_BURST = 3  # Messages that may be sent to a single chat back to back
+GLOBAL_RATE = 25.0  # Sustained messages per second across all chats, per account
+GLOBAL_BURST = 30  # Messages that may be sent across all chats back to back, per account
+ACCOUNT_POLICY = "hash"  # "hash" assigns destinations to accounts by consistent hashing, "least_loaded" to the least busy one
+ACCOUNT_HASH_REPLICAS = 64  # Points per account on the consistent hashing ring
+ACCOUNT_FORBIDDEN_RETRY = 3600  # seconds before an account that lost write access to a chat is tried there again
 QUEUE_INACTIVITY_THRESHOLD = 600  # 10 minutes in seconds for queue inactivity alert
 NUM_WORKERS = 3  # Number of async workers for queue processing
+QUEUE_OVERFLOW_POLICY = "block"  # "block" waits for queue space, "drop" discards new messages and alerts
+QUEUE_DROP_ALERT_INTERVAL = 300  # Min seconds between queue overflow alerts
+LANE_STATUS_LIMIT = 10  # Busiest lanes listed by /status
+OFFLINE_EVENT_BUFFER = 10000  # Edits and deletions held while disconnected, replayed on reconnect
+CATCH_UP_MAX_MESSAGES = 500  # Newest missed messages per source chat queued after a restart or reconnect
+CATCH_UP_QUEUE_SHARE = 0.5  # Share of the queue catch-up jobs may fill; the rest is kept free for live messages
 
 # Logging setup
 logging.basicConfig(
@@ -49,20 +133,858 @@ logger = logging.getLogger("ForwardBot")
 
 # Data structures
 channel_mappings = {}
-message_queue = deque(maxlen=MAX_QUEUE_SIZE)
-is_connected = False
+source_index = {}  # source chat id -> [(user_id, pair_name, mapping), ...] for active pairs
+compiled_filters = {}  # (user_id, pair_name) -> compiled blocked-sentence and blacklist automaton
+
+class LaneScheduler:
+    """Bounded scheduler of per-(source, destination) lanes.
+
+    Items in a lane are handed out strictly in order and never to two workers
+    at once, while different lanes run in parallel. Ready lanes are served
+    round-robin, one item per turn, so a busy lane can't starve quiet ones.
+    Low-priority producers may only fill the queue up to low_limit.
+    Items for a parked destination leave the shared capacity and get a
+    maxsize of their own, so one flood-waited destination can't block (or,
+    with put_nowait, drop) the items of every other lane.
+    """
+
+    def __init__(self, maxsize, low_limit=None):
+        self.maxsize = maxsize
+        self.low_limit = low_limit or maxsize
+        self.lanes = {}  # lane -> deque of (item, enqueued_at)
+        self.ready = deque()  # lanes with pending items that no worker holds
+        self.busy = set()
+        self.lane_stats = {}  # lane -> {'processed', 'total_wait', 'max_wait'}
+        self.parked = {}  # destination -> monotonic resume time after a flood wait
+        self.shelved = {}  # destination -> lanes set aside until it resumes
+        self.size = 0  # items counted against maxsize: those for destinations that aren't parked
+        self.destination_size = {}  # destination -> items queued for it
+        self.getters = deque()
+        self.putters = deque()
+        self.low_putters = deque()
+        self.parked_putters = {}  # destination -> producers waiting for room while it is parked
+        self.handed = {}  # None (shared space) or parked destination -> slots handed to producers not yet run
+
+    def qsize(self):
+        return sum(self.destination_size.values())
+
+    def _room(self, lane, limit):
+        """Return the free slots for a lane under limit, not counting slots already handed to woken producers."""
+        if lane[1] in self.parked:
+            return self.maxsize - self.destination_size.get(lane[1], 0) - self.handed.get(lane[1], 0)
+        return limit - self.size - self.handed.get(None, 0)
+
+    def full(self, lane):
+        """Whether an item for a lane has to wait for space."""
+        return self._room(lane, self.maxsize) <= 0
+
+    def _added(self, lane):
+        destination = lane[1]
+        self.destination_size[destination] = self.destination_size.get(destination, 0) + 1
+        if destination not in self.parked:
+            self.size += 1
+
+    def _removed(self, lane):
+        destination = lane[1]
+        self.destination_size[destination] -= 1
+        if not self.destination_size[destination]:
+            del self.destination_size[destination]
+        if destination in self.parked:
+            self._wake(self.parked_putters.get(destination, deque()), destination)
+        else:
+            self.size -= 1
+            self._wake_putters()
+
+    def _wake(self, waiters, slot=False):
+        """Wake the first live waiter, handing it a freed slot of a pool unless slot is False; returns whether one woke."""
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                if slot is not False:
+                    self.handed[slot] = self.handed.get(slot, 0) + 1
+                waiter.set_result(slot)
+                return True
+        return False
+
+    async def _wait(self, waiters):
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            waiter.cancel()
+            if waiter in waiters:
+                waiters.remove(waiter)
+            elif not waiter.cancelled():
+                # Pass on a wakeup (and slot) we received but can't use
+                slot = waiter.result()
+                if slot is not False:
+                    self.handed[slot] -= 1
+                self._wake(waiters, slot)
+            raise
+
+    def _append(self, lane, item):
+        queue = self.lanes.setdefault(lane, deque())
+        queue.append((item, time.monotonic()))
+        self._added(lane)
+        if len(queue) == 1 and lane not in self.busy:
+            self.ready.append(lane)
+            self._wake(self.getters)
+
+    def put_nowait(self, lane, item):
+        """Append an item to a lane, raising asyncio.QueueFull when at capacity."""
+        if self.full(lane):
+            raise asyncio.QueueFull
+        self._append(lane, item)
+
+    async def put(self, lane, item):
+        """Append an item to a lane, waiting for space when at capacity."""
+        await self._put(lane, item, self.maxsize, (self.putters,))
+
+    async def put_low(self, lane, item):
+        """Append an item to a lane, waiting until fewer than low_limit items are queued."""
+        await self._put(lane, item, self.low_limit, (self.putters, self.low_putters))
+
+    async def _put(self, lane, item, limit, queues):
+        """Append an item once there is room under limit, behind every producer already waiting in queues.
+
+        Waiting producers are served in arrival order: a freed slot is handed
+        to the first one and counted at once, so a producer arriving before it
+        runs can't take the slot and overtake it.
+        """
+        while True:
+            if lane[1] in self.parked:
+                ahead = (self.parked_putters.setdefault(lane[1], deque()),)
+            else:
+                ahead = queues
+            if not any(ahead) and self._room(lane, limit) > 0:
+                self._append(lane, item)
+                return
+            slot = await self._wait(ahead[-1])
+            if slot is not False:
+                self.handed[slot] -= 1
+                self._append(lane, item)
+                return
+
+    def _wake_putters(self):
+        """Hand a freed shared slot to the first waiting producer, ahead of low-priority ones."""
+        if not self._wake(self.putters, None) and self.size + self.handed.get(None, 0) < self.low_limit:
+            self._wake(self.low_putters, None)
+
+    async def get(self):
+        """Wait for the next ready lane and return (lane, item); call done(lane) afterwards."""
+        while True:
+            while not self.ready:
+                await self._wait(self.getters)
+            lane = self.ready.popleft()
+            if lane[1] not in self.parked:
+                break
+            self.shelved.setdefault(lane[1], set()).add(lane)
+        item, enqueued_at = self.lanes[lane].popleft()
+        self.busy.add(lane)
+        self._removed(lane)
+        wait = time.monotonic() - enqueued_at
+        stats = self.lane_stats.setdefault(lane, {'processed': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+        stats['processed'] += 1
+        stats['total_wait'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+        return lane, item
+
+    def done(self, lane):
+        """Release a lane after its item has been processed."""
+        self.busy.discard(lane)
+        if self.lanes.get(lane):
+            self.ready.append(lane)
+            self._wake(self.getters)
+        else:
+            self.lanes.pop(lane, None)
+
+    def take_while(self, lane, predicate, limit):
+        """Pop up to limit further items from the head of a lane the caller holds, while predicate(item) holds."""
+        queue = self.lanes.get(lane)
+        items = []
+        while queue and len(items) < limit and predicate(queue[0][0]):
+            item, enqueued_at = queue.popleft()
+            self._removed(lane)
+            stats = self.lane_stats[lane]
+            wait = time.monotonic() - enqueued_at
+            stats['processed'] += 1
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+            items.append(item)
+        return items
+
+    def requeue(self, lane, item):
+        """Put an item back at the head of its lane, ahead of everything queued after it."""
+        self.lanes.setdefault(lane, deque()).appendleft((item, time.monotonic()))
+        self._added(lane)
+
+    def park(self, destination, seconds):
+        """Hold back every lane to a destination for the given number of seconds.
+
+        Its queued items stop counting against maxsize until it resumes.
+        """
+        resume_at = time.monotonic() + seconds
+        if resume_at <= self.parked.get(destination, 0):
+            return
+        if destination not in self.parked:
+            freed = self.destination_size.get(destination, 0)
+            self.size -= freed
+            for _ in range(freed):
+                self._wake_putters()
+        self.parked[destination] = resume_at
+        asyncio.get_running_loop().call_later(seconds, self._unpark, destination, resume_at)
+
+    def _unpark(self, destination, resume_at):
+        if self.parked.get(destination) != resume_at:
+            return  # parked again for longer in the meantime
+        del self.parked[destination]
+        self.size += self.destination_size.get(destination, 0)
+        # Producers waiting on the parked destination go back to waiting for shared space
+        waiters = self.parked_putters.pop(destination, deque())
+        while waiters:
+            self._wake(waiters)
+        for lane in self.shelved.pop(destination, ()):
+            self.ready.append(lane)
+            self._wake(self.getters)
+
+    def parked_report(self):
+        """Return (destination, seconds until resume) for every parked destination."""
+        now = time.monotonic()
+        return sorted((destination, resume_at - now) for destination, resume_at in self.parked.items())
+
+    def oldest(self):
+        """Return the oldest queued item across all lanes, or None."""
+        heads = [queue[0] for queue in self.lanes.values() if queue]
+        return min(heads, key=lambda head: head[1])[0] if heads else None
+
+    def lane_report(self):
+        """Return (lane, depth, head_wait, avg_wait, busy) for every lane with queued or running work."""
+        now = time.monotonic()
+        report = []
+        for lane, queue in self.lanes.items():
+            stats = self.lane_stats.get(lane, {'processed': 0, 'total_wait': 0.0})
+            head_wait = now - queue[0][1] if queue else 0.0
+            avg_wait = stats['total_wait'] / stats['processed'] if stats['processed'] else 0.0
+            report.append((lane, len(queue), head_wait, avg_wait, lane in self.busy))
+        return sorted(report, key=lambda entry: (-entry[1], -entry[2]))
+
+message_queue = LaneScheduler(maxsize=MAX_QUEUE_SIZE, low_limit=max(1, int(MAX_QUEUE_SIZE * CATCH_UP_QUEUE_SHARE)))
+queue_dropped = 0
+last_drop_alert = 0.0
+connected = asyncio.Event()  # set while the client's main connection is up
+offline_events = deque(maxlen=OFFLINE_EVENT_BUFFER)  # ('edit', message) or ('delete', chat id, ids) seen while disconnected
 pair_stats = {}
+STAT_COUNTERS = ('forwarded', 'edited', 'deleted', 'blocked', 'queued')
+stats_buckets = {}  # (user_id, pair_name, hour) -> counter increments not yet flushed
+pair_cursors = {}  # (user_id, pair_name) -> highest source message ID queued for the pair
+loop_lag = {'last': 0.0, 'max': 0.0, 'samples': deque(maxlen=120)}
 
 # Helper Functions
+class MessageStore:
+    """SQLite-backed source -> destination message ID store with a hot LRU and batched writes."""
+
+    def __init__(self, path, cache_size=MESSAGE_CACHE_SIZE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS forwarded_messages ("
+            "source_chat INTEGER NOT NULL, source_msg_id INTEGER NOT NULL, destination INTEGER NOT NULL, "
+            "dest_msg_id INTEGER NOT NULL, created REAL NOT NULL, content_hash INTEGER, account TEXT, "
+            "PRIMARY KEY (source_chat, source_msg_id, destination)) WITHOUT ROWID"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(forwarded_messages)")]
+        if 'content_hash' not in columns:
+            self.conn.execute("ALTER TABLE forwarded_messages ADD COLUMN content_hash INTEGER")
+        if 'account' not in columns:
+            self.conn.execute("ALTER TABLE forwarded_messages ADD COLUMN account TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS forwarded_messages_created ON forwarded_messages (created)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_hashes ("
+            "photo_id INTEGER PRIMARY KEY, hash TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        counters = ", ".join(f"{key} INTEGER NOT NULL DEFAULT 0" for key in STAT_COUNTERS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS pair_stats (user_id TEXT NOT NULL, pair_name TEXT NOT NULL, {counters}, "
+            "last_activity TEXT, PRIMARY KEY (user_id, pair_name))"
+        )
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS pair_stats_hourly (user_id TEXT NOT NULL, pair_name TEXT NOT NULL, "
+            f"hour INTEGER NOT NULL, {counters}, PRIMARY KEY (user_id, pair_name, hour)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pair_cursors (user_id TEXT NOT NULL, pair_name TEXT NOT NULL, "
+            "source_chat INTEGER NOT NULL, last_msg_id INTEGER NOT NULL, PRIMARY KEY (user_id, pair_name))"
+        )
+        self.conn.commit()
+        self.cache = OrderedDict()  # key -> (dest_msg_id, content_hash, account)
+        self.cache_size = cache_size
+        self.pending = {}  # key -> (dest_msg_id, content_hash, account, created), or None for a pending delete
+        self.hash_cache = OrderedDict()
+        self.pending_hashes = {}  # photo_id -> (hash, created)
+        self.pending_cursors = {}  # (user_id, pair_name) -> (source_chat, last_msg_id), or None for a pending delete
+
+    def _remember(self, key, entry):
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get_entry(self, source_chat, source_msg_id, destination):
+        """Return (dest_msg_id, content_hash, account) for a source message, or None."""
+        key = (int(source_chat), int(source_msg_id), int(destination))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if key in self.pending:
+            entry = self.pending[key]
+            return entry[:3] if entry else None
+        row = self.conn.execute(
+            "SELECT dest_msg_id, content_hash, account FROM forwarded_messages "
+            "WHERE source_chat = ? AND source_msg_id = ? AND destination = ?",
+            key
+        ).fetchone()
+        if row is None:
+            return None
+        self._remember(key, row)
+        return row
+
+    def get(self, source_chat, source_msg_id, destination):
+        """Return the destination message ID for a source message, or None."""
+        entry = self.get_entry(source_chat, source_msg_id, destination)
+        return entry[0] if entry else None
+
+    def get_many(self, source_chat, source_msg_ids, destination):
+        """Return {source_msg_id: (dest_msg_id, account)} for the given source messages that have a mapping."""
+        source_chat, destination = int(source_chat), int(destination)
+        found = {}
+        missing = []
+        for source_msg_id in source_msg_ids:
+            key = (source_chat, int(source_msg_id), destination)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                found[key[1]] = self.cache[key][0], self.cache[key][2]
+            elif key in self.pending:
+                if self.pending[key]:
+                    found[key[1]] = self.pending[key][0], self.pending[key][2]
+            else:
+                missing.append(key[1])
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self.conn.execute(
+                "SELECT source_msg_id, dest_msg_id, account FROM forwarded_messages "
+                f"WHERE source_chat = ? AND destination = ? AND source_msg_id IN ({', '.join('?' * len(chunk))})",
+                (source_chat, destination, *chunk)
+            ).fetchall()
+            for source_msg_id, dest_msg_id, account in rows:
+                found[source_msg_id] = dest_msg_id, account
+        return found
+
+    def put(self, source_chat, source_msg_id, destination, dest_msg_id, content_hash=None, account=None):
+        """Record a forwarded message, a hash of what it shows and the account that sent it; written on the next flush."""
+        key = (int(source_chat), int(source_msg_id), int(destination))
+        self._remember(key, (dest_msg_id, content_hash, account))
+        self.pending[key] = (dest_msg_id, content_hash, account, time.time())
+
+    def delete(self, source_chat, source_msg_id, destination):
+        """Forget a forwarded message; removed from disk on the next flush."""
+        key = (int(source_chat), int(source_msg_id), int(destination))
+        self.cache.pop(key, None)
+        self.pending[key] = None
+
+    def get_image_hash(self, photo_id):
+        """Return the cached pHash of a Telegram photo, or None."""
+        if photo_id in self.hash_cache:
+            self.hash_cache.move_to_end(photo_id)
+            return self.hash_cache[photo_id]
+        if photo_id in self.pending_hashes:
+            return self.pending_hashes[photo_id][0]
+        row = self.conn.execute("SELECT hash FROM image_hashes WHERE photo_id = ?", (photo_id,)).fetchone()
+        if row is None:
+            return None
+        self._remember_hash(photo_id, row[0])
+        return row[0]
+
+    def put_image_hash(self, photo_id, image_hash):
+        """Cache the pHash of a Telegram photo; written to disk on the next flush."""
+        self._remember_hash(photo_id, image_hash)
+        self.pending_hashes[photo_id] = (image_hash, time.time())
+
+    def _remember_hash(self, photo_id, image_hash):
+        self.hash_cache[photo_id] = image_hash
+        self.hash_cache.move_to_end(photo_id)
+        if len(self.hash_cache) > IMAGE_HASH_CACHE_SIZE:
+            self.hash_cache.popitem(last=False)
+
+    def load_cursors(self):
+        """Return {(user_id, pair_name): (source_chat, last_msg_id)} as last saved."""
+        rows = self.conn.execute("SELECT user_id, pair_name, source_chat, last_msg_id FROM pair_cursors").fetchall()
+        return {(row[0], row[1]): (row[2], row[3]) for row in rows}
+
+    def put_cursor(self, user_id, pair_name, source_chat, last_msg_id):
+        """Record the last source message queued for a pair; written to disk on the next flush."""
+        self.pending_cursors[(user_id, pair_name)] = (int(source_chat), int(last_msg_id))
+
+    def delete_cursor(self, user_id, pair_name):
+        """Forget the catch-up position of a pair; removed from disk on the next flush."""
+        self.pending_cursors[(user_id, pair_name)] = None
+
+    def flush(self):
+        """Write all pending changes in a single transaction.
+
+        If the write fails, the changes are kept pending for the next flush.
+        """
+        if not self.pending and not self.pending_hashes and not self.pending_cursors:
+            return 0
+        pending, self.pending = self.pending, {}
+        hashes, self.pending_hashes = self.pending_hashes, {}
+        cursors, self.pending_cursors = self.pending_cursors, {}
+        try:
+            self._write(pending, hashes, cursors)
+        except sqlite3.Error:
+            # Changes made since the swap are newer and win over the failed batch
+            pending.update(self.pending)
+            hashes.update(self.pending_hashes)
+            cursors.update(self.pending_cursors)
+            self.pending, self.pending_hashes, self.pending_cursors = pending, hashes, cursors
+            raise
+        return len(pending) + len(hashes) + len(cursors)
+
+    def _write(self, pending, hashes, cursors):
+        upserts = [key + entry for key, entry in pending.items() if entry]
+        deletes = [key for key, entry in pending.items() if not entry]
+        with self.conn:
+            if cursors:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO pair_cursors VALUES (?, ?, ?, ?)",
+                    [key + entry for key, entry in cursors.items() if entry]
+                )
+                self.conn.executemany(
+                    "DELETE FROM pair_cursors WHERE user_id = ? AND pair_name = ?",
+                    [key for key, entry in cursors.items() if not entry]
+                )
+            if hashes:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO image_hashes VALUES (?, ?, ?)",
+                    [(photo_id,) + entry for photo_id, entry in hashes.items()]
+                )
+            if upserts:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO forwarded_messages "
+                    "(source_chat, source_msg_id, destination, dest_msg_id, content_hash, account, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    upserts
+                )
+            if deletes:
+                self.conn.executemany(
+                    "DELETE FROM forwarded_messages WHERE source_chat = ? AND source_msg_id = ? AND destination = ?",
+                    deletes
+                )
+
+    def load_pair_stats(self):
+        """Return {(user_id, pair_name): stats dict} as last saved."""
+        rows = self.conn.execute(
+            f"SELECT user_id, pair_name, {', '.join(STAT_COUNTERS)}, last_activity FROM pair_stats"
+        ).fetchall()
+        return {
+            (row[0], row[1]): dict(zip(STAT_COUNTERS + ('last_activity',), row[2:]))
+            for row in rows
+        }
+
+    def save_pair_stats(self, stats, buckets):
+        """Save current pair counters and add hourly increments, in one transaction."""
+        columns = ', '.join(STAT_COUNTERS)
+        placeholders = ', '.join('?' * len(STAT_COUNTERS))
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO pair_stats (user_id, pair_name, {columns}, last_activity) "
+                f"VALUES (?, ?, {placeholders}, ?)",
+                [
+                    (user_id, pair_name, *(counters[key] for key in STAT_COUNTERS), counters['last_activity'])
+                    for user_id, pairs in stats.items() for pair_name, counters in pairs.items()
+                ]
+            )
+            self.conn.executemany(
+                f"INSERT INTO pair_stats_hourly (user_id, pair_name, hour, {columns}) VALUES (?, ?, ?, {placeholders}) "
+                "ON CONFLICT (user_id, pair_name, hour) DO UPDATE SET "
+                + ', '.join(f"{key} = {key} + excluded.{key}" for key in STAT_COUNTERS),
+                [key + tuple(counters[name] for name in STAT_COUNTERS) for key, counters in buckets.items()]
+            )
+
+    def pair_stats_history(self, user_id, pair_name, since_hour, bucket_hours=1):
+        """Return [(bucket start hour, {counter: total})] for a pair since an hour, oldest first."""
+        sums = ', '.join(f"SUM({key})" for key in STAT_COUNTERS)
+        rows = self.conn.execute(
+            f"SELECT hour / ? * ? AS bucket, {sums} FROM pair_stats_hourly "
+            "WHERE user_id = ? AND pair_name = ? AND hour >= ? GROUP BY bucket ORDER BY bucket",
+            (bucket_hours, bucket_hours, user_id, pair_name, since_hour)
+        ).fetchall()
+        return [(row[0], dict(zip(STAT_COUNTERS, row[1:]))) for row in rows]
+
+    def prune(self, retention_days=MESSAGE_RETENTION_DAYS, max_rows=MESSAGE_STORE_MAX_ROWS):
+        """Drop mappings older than the retention period or beyond the row limit."""
+        self.flush()
+        with self.conn:
+            removed = self.conn.execute(
+                "DELETE FROM forwarded_messages WHERE created < ?", (time.time() - retention_days * 86400,)
+            ).rowcount
+            total = self.conn.execute("SELECT COUNT(*) FROM forwarded_messages").fetchone()[0]
+            if total > max_rows:
+                removed += self.conn.execute(
+                    "DELETE FROM forwarded_messages WHERE created <= "
+                    "(SELECT created FROM forwarded_messages ORDER BY created LIMIT 1 OFFSET ?)",
+                    (total - max_rows - 1,)
+                ).rowcount
+            self.conn.execute(
+                "DELETE FROM pair_stats_hourly WHERE hour < ?", (int(time.time() // 3600) - STATS_HISTORY_DAYS * 24,)
+            )
+            total = self.conn.execute("SELECT COUNT(*) FROM image_hashes").fetchone()[0]
+            if total > IMAGE_HASH_STORE_MAX_ROWS:
+                self.conn.execute(
+                    "DELETE FROM image_hashes WHERE created <= "
+                    "(SELECT created FROM image_hashes ORDER BY created LIMIT 1 OFFSET ?)",
+                    (total - IMAGE_HASH_STORE_MAX_ROWS - 1,)
+                )
+        self.cache.clear()
+        return removed
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+message_store = None
+
+class QueueLog:
+    """Append-only JSON-lines log of queued jobs, so queued work survives restarts and crashes.
+
+    A job is logged as an 'add' record (chat, message IDs, pair) when queued and
+    an 'ack' record once processed or dropped. Appends are buffered and fsynced
+    on flush(); once acks outnumber the live jobs the log is rewritten with just
+    the live ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.live = {}  # job id -> add record
+        self.next_id = 1
+        self.acked = 0
+        self.buffer = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write at a crash
+                    if record['op'] == 'add':
+                        self.live[record['id']] = record
+                        self.next_id = max(self.next_id, record['id'] + 1)
+                    else:
+                        self.live.pop(record['id'], None)
+        except FileNotFoundError:
+            pass
+        self.compact()
+
+    def add(self, record):
+        """Log a new job and return its ID."""
+        record = dict(record, op='add', id=self.next_id)
+        self.next_id += 1
+        self.live[record['id']] = record
+        self.buffer.append(json.dumps(record))
+        return record['id']
+
+    def ack(self, job_id):
+        """Mark a job as finished."""
+        if self.live.pop(job_id, None) is not None:
+            self.buffer.append(json.dumps({'op': 'ack', 'id': job_id}))
+            self.acked += 1
+
+    def flush(self):
+        """Write buffered records to disk, compacting the log when it is mostly acks."""
+        if self.acked > QUEUE_LOG_COMPACT_AT and self.acked > len(self.live):
+            self.compact()
+            return
+        if not self.buffer:
+            return
+        buffer, self.buffer = self.buffer, []
+        self.file.write("\n".join(buffer) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def compact(self):
+        """Rewrite the log with only the unacknowledged jobs."""
+        if getattr(self, 'file', None):
+            self.file.close()
+        records = sorted(self.live.values(), key=lambda record: record['id'])
+        write_file_atomic(self.path, "".join(json.dumps(record) + "\n" for record in records))
+        self.buffer = []
+        self.acked = 0
+        self.file = open(self.path, "a")
+
+    def pending(self):
+        """Return the unacknowledged job records, oldest first."""
+        return sorted(self.live.values(), key=lambda record: record['id'])
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+queue_log = None
+queue_replayed = asyncio.Event()
+
+class TokenBucket:
+    """Token bucket rate limiter; acquire() waits, in FIFO order, until a token is free."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+global_limiters = {session: TokenBucket(GLOBAL_RATE, GLOBAL_BURST) for session in pool_clients}
+destination_limiters = {}  # chat id -> TokenBucket
+
+async def throttle(destination, sender=None):
+    """Wait for a send slot for a chat under both its own and the sending account's global rate limit."""
+    destination = int(destination)
+    limiter = destination_limiters.get(destination)
+    if limiter is None:
+        limiter = destination_limiters[destination] = TokenBucket(DESTINATION_RATE, DESTINATION_BURST)
+    await limiter.acquire()
+    await global_limiters[account_name(sender)].acquire()
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class SessionPool:
+    """Accounts that share the sending load, each a separate client.
+
+    A destination is served by one account, picked by consistent hashing (so
+    adding an account only moves its share of destinations) or as the least
+    loaded one, unless its pair is pinned to an account. Accounts that are
+    flood-limited or lost write access to a chat are skipped until they can
+    send there again.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.names = {id(pool_client): name for name, pool_client in clients.items()}
+        self.ring = sorted(
+            (ring_hash(f"{name}#{i}"), name) for name in clients for i in range(ACCOUNT_HASH_REPLICAS)
+        )
+        self.flooded = {}  # account -> monotonic time its flood wait ends
+        self.forbidden = {}  # (account, chat id) -> monotonic time to try writing there again
+        self.load = dict.fromkeys(clients, 0)  # account -> sends in progress
+        self.down = set()  # accounts that failed to start
+        self.sent = dict.fromkeys(clients, 0)
+
+    def ring_order(self, destination):
+        """Return every account in ring order starting from a destination's point."""
+        start = bisect.bisect(self.ring, (ring_hash(str(destination)),))
+        order = []
+        for _, name in self.ring[start:] + self.ring[:start]:
+            if name not in order:
+                order.append(name)
+                if len(order) == len(self.clients):
+                    break
+        return order
+
+    def accounts_for(self, mapping):
+        """Return the accounts that may send for a pair, in order of preference, ignoring availability."""
+        pinned = mapping.get('account')
+        if pinned in self.clients:
+            return [pinned]
+        if ACCOUNT_POLICY == "least_loaded":
+            return sorted(self.clients, key=lambda name: (self.load[name], self.sent[name]))
+        return self.ring_order(int(mapping['destination']))
+
+    def available(self, name, destination):
+        now = time.monotonic()
+        return (
+            name not in self.down and self.flooded.get(name, 0) <= now
+            and self.forbidden.get((name, destination), 0) <= now
+        )
+
+    def candidates(self, mapping, exclude=()):
+        """Return the accounts that can send for a pair right now, in order of preference."""
+        destination = int(mapping['destination'])
+        return [
+            name for name in self.accounts_for(mapping)
+            if name not in exclude and self.available(name, destination)
+        ]
+
+    def flood(self, name, seconds):
+        self.flooded[name] = max(self.flooded.get(name, 0), time.monotonic() + seconds)
+
+    def forbid(self, name, destination):
+        self.forbidden[(name, int(destination))] = time.monotonic() + ACCOUNT_FORBIDDEN_RETRY
+
+    def unavailable_error(self, mapping):
+        """Return the error to raise when no account can send for a pair: a flood wait until the first one frees up."""
+        now = time.monotonic()
+        names = [name for name in self.accounts_for(mapping) if name not in self.down]
+        resume = [self.flooded[name] - now for name in names if self.flooded.get(name, 0) > now]
+        if resume:
+            return errors.FloodWaitError(request=None, capture=max(1, int(min(resume)) + 1))
+        if names:
+            return errors.ChatWriteForbiddenError(request=None)
+        return ConnectionError("no pool account is connected")
+
+    def report(self):
+        """Return (account, sends in progress, sent, flood wait left) for every account."""
+        now = time.monotonic()
+        return [
+            (name, self.load[name], self.sent[name], max(0.0, self.flooded.get(name, 0) - now))
+            for name in self.clients
+        ]
+
+session_pool = SessionPool(pool_clients)
+
+def account_name(sender):
+    """Return the session name of a pool client; None means the main client."""
+    return session_pool.names.get(id(sender), SESSION_FILE) if sender is not None else SESSION_FILE
+
+def account_client(name):
+    """Return the client of a stored account name, falling back to the main client."""
+    return session_pool.clients.get(name or SESSION_FILE, client)
+
+async def start_pool_clients():
+    """Log in the extra pool accounts and cache their dialogs, so they can resolve chats by ID."""
+    for session, pool_client in pool_clients.items():
+        if pool_client is client:
+            continue
+        try:
+            await pool_client.start()
+            await pool_client.get_dialogs()
+            logger.info(f"Pool account {session} ready")
+        except Exception as e:
+            session_pool.down.add(session)
+            logger.error(f"Pool account {session} failed to start and won't be used: {e}")
+
+async def source_media(sender, mapping, messages):
+    """Return the media of source messages as an account can send it.
+
+    Media fetched by the main client can't be reused by another account, so a
+    pool account fetches the source messages again with its own client.
+    """
+    if sender is None or sender is client:
+        return [message.media for message in messages]
+    own_messages = await sender.get_messages(int(mapping['source']), ids=[message.id for message in messages])
+    media = [own_message.media if own_message else None for own_message in own_messages]
+    if not all(media):
+        raise errors.MediaEmptyError(request=None)
+    return media
+
+async def send_via(mapping, send):
+    """Run send(sender) with an account for a pair's destination and return (account, result).
+
+    When the account is flood-limited, lost write access, or can't get the
+    source media, the next available account is tried. If none is left, a
+    flood wait is raised while any of the pair's accounts is flood-limited and
+    the last error otherwise, so the lane is parked or the pair disabled as
+    usual.
+    A send of several requests is run again from the start on failover, so it
+    must skip what it already sent (see send_progress).
+    """
+    destination = int(mapping['destination'])
+    tried = set()
+    candidates = session_pool.candidates(mapping)
+    if not candidates:
+        raise session_pool.unavailable_error(mapping)
+    while True:
+        name = candidates[0]
+        session_pool.load[name] += 1
+        try:
+            result = await send(session_pool.clients[name])
+            session_pool.sent[name] += 1
+            return name, result
+        except errors.FloodWaitError as e:
+            session_pool.flood(name, e.seconds)
+            error = e
+        except (errors.ChatWriteForbiddenError, errors.UserBannedInChannelError, errors.ChannelPrivateError) as e:
+            session_pool.forbid(name, destination)
+            error = e
+        except (errors.FileReferenceExpiredError, errors.MediaEmptyError) as e:
+            error = e
+        finally:
+            session_pool.load[name] -= 1
+        tried.add(name)
+        candidates = session_pool.candidates(mapping, tried)
+        if not candidates:
+            # While an account is only flood-limited, park the lane until it frees up rather than fail the job
+            unavailable = session_pool.unavailable_error(mapping)
+            raise unavailable if isinstance(unavailable, errors.FloodWaitError) else error
+        logger.warning(f"Account {name} can't send to {destination} ({error.__class__.__name__}); failing over to {candidates[0]}")
+
+def write_file_atomic(path, data):
+    """Write data to path via a fsynced temp file and rename, so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+mappings_changed = asyncio.Event()
+mappings_version = 0  # bumped on every change
+mappings_written = {'version': -1, 'lock': threading.Lock()}
+
 def save_mappings():
-    """Save channel mappings to a JSON file."""
+    """Schedule a save of the channel mappings; changes within MAPPINGS_SAVE_DELAY share one write."""
+    global mappings_version
+    mappings_version += 1
+    mappings_changed.set()
+
+def write_mappings(data, version):
+    """Write a mappings snapshot unless a newer one is already on disk."""
+    with mappings_written['lock']:
+        if version <= mappings_written['version']:
+            return
+        write_file_atomic(MAPPINGS_FILE, data)
+        mappings_written['version'] = version
+    logger.info("Channel mappings saved to file.")
+
+def save_mappings_now():
+    """Write the channel mappings to disk immediately."""
+    mappings_changed.clear()
     try:
-        with open(MAPPINGS_FILE, "w") as f:
-            json.dump(channel_mappings, f)
-        logger.info("Channel mappings saved to file.")
+        write_mappings(json.dumps(channel_mappings), mappings_version)
     except Exception as e:
         logger.error(f"Error saving mappings: {e}")
 
+async def persist_mappings():
+    """Write the channel mappings in the background whenever they change."""
+    while True:
+        await mappings_changed.wait()
+        await asyncio.sleep(MAPPINGS_SAVE_DELAY)
+        mappings_changed.clear()
+        data = json.dumps(channel_mappings)  # snapshot on the loop; the disk write runs in a thread
+        try:
+            await asyncio.to_thread(write_mappings, data, mappings_version)
+        except Exception as e:
+            logger.error(f"Error saving mappings: {e}")
+            mappings_changed.set()
+
 def load_mappings():
     """Load channel mappings from a JSON file, handling corrupted files."""
     global channel_mappings
@@ -70,13 +992,26 @@ def load_mappings():
         with open(MAPPINGS_FILE, "r") as f:
             channel_mappings = json.load(f)
         logger.info(f"Loaded {sum(len(v) for v in channel_mappings.values())} mappings from file.")
+        saved_stats = message_store.load_pair_stats()
         for user_id, pairs in channel_mappings.items():
             if user_id not in pair_stats:
                 pair_stats[user_id] = {}
             for pair_name in pairs:
-                pair_stats[user_id][pair_name] = {
+                pair_stats[user_id][pair_name] = saved_stats.get((user_id, pair_name)) or {
                     'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
                 }
+        logger.info(f"Restored stats for {len(saved_stats)} pairs.")
+        for user_id, pairs in channel_mappings.items():
+            for pair_name, mapping in pairs.items():
+                if stale_image_hashes(mapping):
+                    logger.warning(
+                        f"Blocked image hashes of pair '{pair_name}' were taken from full-size images; "
+                        "clear and block them again so they match thumbnail hashes"
+                    )
+        for (user_id, pair_name), (source_chat, last_msg_id) in message_store.load_cursors().items():
+            mapping = channel_mappings.get(user_id, {}).get(pair_name)
+            if mapping and str(source_chat) == str(mapping['source']):
+                pair_cursors[(user_id, pair_name)] = last_msg_id
     except FileNotFoundError:
         logger.info("No existing mappings file found. Starting fresh.")
     except json.JSONDecodeError as e:
@@ -85,174 +1020,676 @@ def load_mappings():
         channel_mappings = {}
     except Exception as e:
         logger.error(f"Error loading mappings: {e}")
+    compiled_filters.clear()
+    rebuild_source_index()
+
+def bump_stat(user_id, pair_name, key, count=1):
+    """Increment a pair counter and its current hourly bucket; both are saved on the next stats flush."""
+    pair_stats[user_id][pair_name][key] += count
+    bucket_key = (user_id, pair_name, int(time.time() // 3600))
+    if bucket_key not in stats_buckets:
+        stats_buckets[bucket_key] = dict.fromkeys(STAT_COUNTERS, 0)
+    stats_buckets[bucket_key][key] += count
+
+def flush_pair_stats():
+    """Save pair counters and pending hourly increments to the message store."""
+    global stats_buckets
+    buckets, stats_buckets = stats_buckets, {}
+    try:
+        message_store.save_pair_stats(pair_stats, buckets)
+    except sqlite3.Error as e:
+        logger.error(f"Error saving pair stats: {e}")
+        for key, counters in buckets.items():
+            pending = stats_buckets.setdefault(key, dict.fromkeys(STAT_COUNTERS, 0))
+            for name, count in counters.items():
+                pending[name] += count
+
+def advance_cursor(user_id, pair_name, mapping, message_id):
+    """Move a pair's catch-up position forward to a newly queued source message."""
+    key = (user_id, pair_name)
+    if message_id > pair_cursors.get(key, 0):
+        pair_cursors[key] = message_id
+        message_store.put_cursor(user_id, pair_name, mapping['source'], message_id)
+
+def reset_cursor(user_id, pair_name):
+    """Forget a pair's catch-up position, so the next catch-up starts from the newest source message."""
+    pair_cursors.pop((user_id, pair_name), None)
+    message_store.delete_cursor(user_id, pair_name)
+
+async def start_cursor(user_id, pair_name, mapping):
+    """Set a pair's catch-up position to the newest source message, so earlier history is never forwarded."""
+    reset_cursor(user_id, pair_name)
+    try:
+        latest = await client.get_messages(int(mapping['source']), limit=1)
+    except (errors.RPCError, ValueError, ConnectionError) as e:
+        logger.warning(f"Could not read the newest message of {mapping['source']} for pair '{pair_name}': {e}")
+        return
+    if latest:
+        advance_cursor(user_id, pair_name, mapping, latest[0].id)
 
-def compile_blocked_sentences(blocked_sentences):
-    """Compile blocked sentences into a single regex pattern."""
-    if not blocked_sentences:
+def rebuild_source_index():
+    """Rebuild the source chat routing index from the active pairs."""
+    global source_index
+    index = {}
+    for user_id, pairs in channel_mappings.items():
+        for pair_name, mapping in pairs.items():
+            if not mapping.get('active'):
+                continue
+            try:
+                source_id = int(mapping['source'])
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Skipping pair '{pair_name}' with invalid source: {mapping.get('source')}")
+                continue
+            index.setdefault(source_id, []).append((user_id, pair_name, mapping))
+    source_index = index
+    logger.info(f"Routing index rebuilt: {sum(len(r) for r in index.values())} active pairs across {len(index)} source chats.")
+
+def get_compiled_filters(user_id, pair_name, mapping):
+    """Return the compiled filters for a pair, building them on first use."""
+    key = (user_id, pair_name)
+    compiled = compiled_filters.get(key)
+    if compiled is None:
+        start_time = time.perf_counter()
+        automaton = build_filter_automaton(mapping.get('blocked_sentences'), mapping.get('blacklist'))
+        image_index = ImageHashIndex(mapping.get('blocked_image_hashes'))
+        memory = automaton.get_stats()['total_size'] if automaton is not None else 0
+        memory += image_index.hashes.nbytes
+        compiled = compiled_filters[key] = {
+            'automaton': automaton,
+            'image_index': image_index,
+            'build_time': time.perf_counter() - start_time,
+            'memory': memory,
+            'built_at': datetime.now().isoformat()
+        }
+        logger.info(
+            f"Compiled filters for pair '{pair_name}' in {compiled['build_time']:.3f}s "
+            f"({len(mapping.get('blocked_sentences') or [])} sentences, {len(mapping.get('blacklist') or [])} words, "
+            f"{len(image_index)} image hashes, ~{memory / 1024:.1f} KiB)"
+        )
+    return compiled
+
+def invalidate_compiled_filters(user_id, pair_name=None):
+    """Drop cached compiled filters for one pair, or for all pairs of a user."""
+    if pair_name is not None:
+        compiled_filters.pop((user_id, pair_name), None)
+        return
+    for key in [key for key in compiled_filters if key[0] == user_id]:
+        del compiled_filters[key]
+
+class ImageHashIndex:
+    """Blocked 64-bit perceptual hashes searchable by Hamming distance with a vectorized popcount scan."""
+
+    POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def __init__(self, hex_hashes):
+        self.hex_hashes = []
+        values = []
+        for hex_hash in hex_hashes or []:
+            try:
+                values.append(int(hex_hash, 16))
+            except (TypeError, ValueError):
+                logger.warning(f"Ignoring invalid blocked image hash: {hex_hash}")
+                continue
+            self.hex_hashes.append(hex_hash)
+        self.hashes = np.array(values, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.hex_hashes)
+
+    def distances(self, image_hash):
+        """Return the Hamming distance from image_hash to every indexed hash."""
+        xor = np.bitwise_xor(self.hashes, np.uint64(image_hash))
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(xor)
+        return self.POPCOUNT_TABLE[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+    def find(self, image_hash, threshold):
+        """Return (hex_hash, distance) of the closest hash within threshold, or None."""
+        if not self.hex_hashes:
+            return None
+        distances = self.distances(image_hash)
+        best = int(np.argmin(distances))
+        if distances[best] > threshold:
+            return None
+        return self.hex_hashes[best], int(distances[best])
+
+def stale_image_hashes(mapping):
+    """Whether a pair's blocked image hashes may come from full-size images and should be added again.
+
+    Incoming photos are hashed from a small thumbnail, which can land a few bits
+    away from the full-size hash; the original images aren't kept, so old
+    hashes can't be recomputed.
+    """
+    return bool(mapping.get('blocked_image_hashes')) and mapping.get('image_hash_source') != IMAGE_HASH_SOURCE
+
+def match_blocked_image(user_id, pair_name, mapping, image_hash):
+    """Return a block reason if image_hash is near one of the pair's blocked images, else None."""
+    threshold = mapping.get('image_hash_threshold', DEFAULT_IMAGE_HASH_THRESHOLD)
+    match = get_compiled_filters(user_id, pair_name, mapping)['image_index'].find(int(image_hash, 16), threshold)
+    if match is None:
+        return None
+    blocked_hash, distance = match
+    return f"Image hash match: {image_hash} ~ {blocked_hash} (distance {distance})"
+
+# Filter engine
+URL_PATTERN = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?:/[^\s]*)?'
+MENTION_PATTERN = r'(?:@[a-zA-Z0-9_]+|\[[^\]]+\]\(tg://user\?id=\d+\))[ \t]*'
+URL_MENTION_REGEX = re.compile(f'(?P<url>{URL_PATTERN})|(?P<mention>{MENTION_PATTERN})')
+
+def build_filter_automaton(blocked_sentences, blacklist):
+    """Build one Aho-Corasick automaton matching both blocked sentences and blacklisted words."""
+    entries = {}
+    for sentence in blocked_sentences or []:
+        if sentence:
+            entries.setdefault(sentence.lower(), [False, False])[0] = True
+    for word in blacklist or []:
+        if word:
+            entries.setdefault(word.lower(), [False, False])[1] = True
+    if not entries:
         return None
-    escaped = [re.escape(s.lower()) for s in blocked_sentences]
-    return re.compile('|'.join(escaped))
-
-def check_blocked_sentences_fast(text, compiled_pattern):
-    """Check if text contains any blocked sentences using compiled regex."""
-    if not text or not compiled_pattern:
-        return False, None
-    match = compiled_pattern.search(text.lower())
-    return (True, match.group(0)) if match else (False, None)
-
-def build_blacklist_trie(words):
-    """Build an Aho-Corasick automaton for fast multi-word searching."""
     A = ahocorasick.Automaton()
-    for idx, word in enumerate(words):
-        A.add_word(word.lower(), (idx, word))
+    for key, (is_sentence, is_word) in entries.items():
+        A.add_word(key, (key, is_sentence, is_word))
     A.make_automaton()
     return A
 
-def filter_text_with_blacklist(text, automaton):
-    """Filter text using Aho-Corasick automaton, replacing matches with '***'."""
-    found = False
-    for end_index, (idx, word) in automaton.iter(text.lower()):
-        text = text.replace(word, '***')
-        found = True
-    return text, found
-
-def filter_urls(text, block_urls, blacklist_urls=None):
-    """Filter or block URLs based on settings."""
-    if not text:
-        return text, True
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?:/[^\s]*)?'
-    urls = re.findall(url_pattern, text)
-    if block_urls:
-        text = re.sub(url_pattern, '[URL REMOVED]', text)
-        return text, False
-    elif blacklist_urls and urls:
-        for url in urls:
-            if any(blacklisted in url for blacklisted in blacklist_urls):
-                text = text.replace(url, '[URL BLOCKED]')
-        return text, True
-    return text, True
-
-def remove_header_footer(text, header_pattern, footer_pattern):
-    """Remove specified header and footer from text."""
-    if not text:
-        return text
+def lower_preserving_length(text):
+    """Lowercase text without changing its length, so match offsets stay valid."""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+def scan_text(text, mapping, automaton):
+    """Scan text once and collect every filter match.
+
+    Returns (block_reason, spans), where spans is a sorted, non-overlapping
+    list of (start, end, replacement, kind) tuples on the original text.
+    """
+    spans = []
+    if automaton is not None:
+        for end_index, (key, is_sentence, is_word) in automaton.iter(lower_preserving_length(text)):
+            if is_sentence:
+                return f"Blocked sentence match: '{key}'", []
+            spans.append((end_index - len(key) + 1, end_index + 1, '***', 'blacklist'))
+
+    block_urls = mapping.get('block_urls', False)
+    blacklist_urls = mapping.get('blacklist_urls')
+    remove_mentions = mapping.get('remove_mentions', False)
+    if block_urls or blacklist_urls or remove_mentions:
+        for match in URL_MENTION_REGEX.finditer(text):
+            if match.lastgroup == 'url':
+                if block_urls:
+                    spans.append((match.start(), match.end(), '[URL REMOVED]', 'url_removed'))
+                elif blacklist_urls and any(blacklisted in match.group() for blacklisted in blacklist_urls):
+                    spans.append((match.start(), match.end(), '[URL BLOCKED]', 'url_blocked'))
+            elif remove_mentions:
+                spans.append((match.start(), match.end(), '', 'mention'))
+
+    header_pattern = mapping.get('header_pattern', '')
+    footer_pattern = mapping.get('footer_pattern', '')
     if header_pattern and text.startswith(header_pattern):
-        text = text[len(header_pattern):].strip()
-    if footer_pattern and text.endswith(footer_pattern):
-        text = text[:-len(footer_pattern)].strip()
-    return text
-
-def apply_custom_header_footer(text, custom_header, custom_footer):
-    """Add custom header and footer to text."""
-    if not text:
-        return text
-    result = text
+        spans.append((0, len(header_pattern), '', 'header'))
+    if footer_pattern:
+        footer_end = len(text.rstrip())
+        if footer_end >= len(footer_pattern) and text[:footer_end].endswith(footer_pattern):
+            spans.append((footer_end - len(footer_pattern), footer_end, '', 'footer'))
+
+    # Keep the earliest, longest span wherever matches overlap
+    resolved = []
+    last_end = 0
+    for span in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if span[0] >= last_end:
+            resolved.append(span)
+            last_end = span[1]
+
+    if any(kind == 'blacklist' for _, _, _, kind in resolved):
+        remainder = []
+        pos = 0
+        for start, end, _, kind in resolved:
+            if kind == 'blacklist':
+                remainder.append(text[pos:start])
+                pos = end
+        remainder.append(text[pos:])
+        if not ''.join(remainder).strip():
+            return "Entire message blacklisted", []
+    return None, resolved
+
+def rewrite_text(text, spans, custom_header='', custom_footer=''):
+    """Apply filter spans in a single pass, strip the result and add the custom header/footer.
+
+    Returns (new_text, edits), where edits is the complete list of
+    (start, end, replacement) changes applied to the original text.
+    """
+    n = len(text)
+    # Leading whitespace, including whitespace exposed by removed spans
+    pos, first = 0, 0
+    while pos < n:
+        if first < len(spans) and spans[first][0] == pos and not spans[first][2]:
+            pos = spans[first][1]
+            first += 1
+        elif (first == len(spans) or spans[first][0] > pos) and text[pos].isspace():
+            pos += 1
+        else:
+            break
+    body_start = pos
+    # Trailing whitespace, symmetrically
+    pos, last = n, len(spans)
+    while pos > body_start:
+        if last > first and spans[last - 1][1] == pos and not spans[last - 1][2]:
+            pos = spans[last - 1][0]
+            last -= 1
+        elif (last == first or spans[last - 1][1] < pos) and text[pos - 1].isspace():
+            pos -= 1
+        else:
+            break
+    body_end = pos
+
+    if body_start >= body_end:
+        return "", [(0, n, '')] if n else []
+
+    # Insertions are kept separate from the stripped whitespace so entities don't grow over them
+    edits = []
     if custom_header:
-        result = f"{custom_header}\n{result}"
+        edits.append((0, 0, f"{custom_header}\n"))
+    if body_start:
+        edits.append((0, body_start, ''))
+    edits.extend((start, end, replacement) for start, end, replacement, _ in spans[first:last])
+    if body_end < n:
+        edits.append((body_end, n, ''))
     if custom_footer:
-        result = f"{result}\n{custom_footer}"
-    return result.strip()
+        edits.append((n, n, f"\n{custom_footer}"))
+
+    pieces = []
+    pos = 0
+    for start, end, replacement in edits:
+        pieces.append(text[pos:start])
+        pieces.append(replacement)
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces), edits
+
+def utf16_len(text):
+    """Return the length of text in UTF-16 code units, as Telegram counts it."""
+    return len(text.encode('utf-16-le')) // 2
+
+def utf16_edits(text, edits):
+    """Convert (start, end, replacement) edits on text to (start, end, replacement_length) in UTF-16 units."""
+    if not edits:
+        return []
+    if utf16_len(text) == len(text):
+        return [(start, end, utf16_len(replacement)) for start, end, replacement in edits]
+    offsets = [0] * (len(text) + 1)
+    for i, char in enumerate(text):
+        offsets[i + 1] = offsets[i] + (2 if ord(char) > 0xFFFF else 1)
+    return [(offsets[start], offsets[end], utf16_len(replacement)) for start, end, replacement in edits]
+
+def map_offsets(positions, edits, is_end):
+    """Map sorted UTF-16 positions through sorted edits in one sweep.
+
+    Positions inside a replaced range snap to the start of the replacement for
+    entity starts and to its end for entity ends; insertions at an entity
+    boundary stay outside the entity.
+    """
+    mapped = {}
+    i = 0
+    delta = 0
+    for pos in positions:
+        while i < len(edits):
+            start, end, replacement_len = edits[i]
+            if end < pos or (end == pos and (not is_end or start < end)):
+                delta += replacement_len - (end - start)
+                i += 1
+            else:
+                break
+        if i < len(edits) and edits[i][0] < pos < edits[i][1]:
+            start, _, replacement_len = edits[i]
+            mapped[pos] = start + delta + (replacement_len if is_end else 0)
+        else:
+            mapped[pos] = pos + delta
+    return mapped
+
+def remap_entities(entities, edits, mapping):
+    """Shift, trim or drop formatting entities to follow UTF-16 text edits.
+
+    Runs in O(entities + edits) apart from sorting the entity boundaries.
+    """
+    if not entities:
+        return entities
+    blacklist_urls = mapping.get('blacklist_urls') or []
+    kept = []
+    for entity in entities:
+        if isinstance(entity, MessageEntityTextUrl) and (
+            mapping.get('block_urls') or any(blacklisted in entity.url for blacklisted in blacklist_urls)
+        ):
+            continue
+        if isinstance(entity, (MessageEntityMentionName, InputMessageEntityMentionName)) and mapping.get('remove_mentions'):
+            continue
+        kept.append(entity)
+    if not edits:
+        return kept
+
+    starts = map_offsets(sorted({e.offset for e in kept}), edits, is_end=False)
+    ends = map_offsets(sorted({e.offset + e.length for e in kept}), edits, is_end=True)
+    edit_starts = [start for start, _, _ in edits]
+    remapped = []
+    for entity in kept:
+        entity_end = entity.offset + entity.length
+        # Entities lying entirely inside a replaced range described content that no longer exists
+        i = bisect.bisect_right(edit_starts, entity.offset) - 1
+        while i >= 0 and edits[i][0] == edits[i][1]:
+            i -= 1
+        if i >= 0 and edits[i][0] <= entity.offset and entity_end <= edits[i][1]:
+            continue
+        new_start, new_end = starts[entity.offset], ends[entity_end]
+        if new_end <= new_start:
+            continue
+        new_entity = copy.copy(entity)
+        new_entity.offset = new_start
+        new_entity.length = new_end - new_start
+        remapped.append(new_entity)
+    return remapped
+
+ATOMIC_ENTITY_TYPES = (
+    MessageEntityUrl, MessageEntityEmail, MessageEntityMention, MessageEntityHashtag, MessageEntityCashtag,
+    MessageEntityBotCommand, MessageEntityPhone, MessageEntityMentionName, InputMessageEntityMentionName
+)  # Entities that mean nothing once cut in two
+
+def is_grapheme_boundary(text, pos):
+    """Whether text can be cut before text[pos] without splitting a user-perceived character.
+
+    Approximates the Unicode rules that matter here: CRLF, combining marks,
+    variation selectors, emoji modifiers and tags, ZWJ sequences and flag pairs.
+    """
+    before, after = text[pos - 1], text[pos]
+    if before == '\r' and after == '\n':
+        return False
+    if before == '\u200d' or after == '\u200d':
+        return False
+    code = ord(after)
+    if unicodedata.category(after) in ('Mn', 'Mc', 'Me') or 0x1F3FB <= code <= 0x1F3FF or 0xE0020 <= code <= 0xE007F:
+        return False
+    if 0x1F1E6 <= code <= 0x1F1FF:
+        flags = 0
+        while pos - flags > 0 and 0x1F1E6 <= ord(text[pos - flags - 1]) <= 0x1F1FF:
+            flags += 1
+        return flags % 2 == 0
+    return True
+
+def break_level(text, pos):
+    """Rank a cut before text[pos]: 0 paragraph, 1 line, 2 sentence, 3 word, 4 anywhere else."""
+    before = text[pos - 1]
+    if before == '\n':
+        return 0 if pos > 1 and text[pos - 2] == '\n' else 1
+    if before.isspace():
+        return 2 if pos > 1 and text[pos - 2] in '.!?\u2026' else 3
+    return 4
+
+def split_text(text, entities=None, limit=MAX_MESSAGE_LENGTH):
+    """Yield (part, entities) pieces of text of at most limit UTF-16 units, each with its own entities.
+
+    Parts end at the last paragraph, line, sentence or word break in their
+    second half when there is one, never inside a grapheme, and avoid cutting
+    through entities short enough to fit in a part (longer ones are cut
+    anyway). Entities crossing a cut are clipped to each part, and whitespace
+    around a cut is dropped.
+    """
+    entities = sorted(entities or [], key=lambda entity: entity.offset)
+    units = [0] * (len(text) + 1)  # UTF-16 offset of every character
+    for i, char in enumerate(text):
+        units[i + 1] = units[i] + (2 if ord(char) > 0xFFFF else 1)
+    if units[-1] <= limit:
+        yield text, entities
+        return
+
+    # Cuts at a character index inside an entity, counted per kind, via prefix sums
+    covered = [0] * (len(text) + 1)
+    atomic = [0] * (len(text) + 1)
+    for entity in entities:
+        if entity.length > limit:
+            continue
+        start = bisect.bisect_left(units, entity.offset) + 1
+        end = bisect.bisect_left(units, entity.offset + entity.length)
+        if start < end:
+            counts = atomic if isinstance(entity, ATOMIC_ENTITY_TYPES) else covered
+            counts[start] += 1
+            counts[end] -= 1
+    for counts in (covered, atomic):
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+
+    start = 0
+    while start < len(text):
+        hard = bisect.bisect_right(units, units[start] + limit) - 1
+        if hard >= len(text):
+            cut = len(text)
+        else:
+            middle = (start + hard) // 2
+            cut, best = hard, None
+            for pos in range(hard, start, -1):
+                if not is_grapheme_boundary(text, pos):
+                    continue
+                level = break_level(text, pos)
+                rank = (bool(atomic[pos]), bool(covered[pos]), level if pos >= middle else max(level, 3))
+                if best is None or rank < best:
+                    cut, best = pos, rank
+                    if rank == (False, False, 0):
+                        break
+        end = cut
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            part_start, part_end = units[start], units[end]
+            part_entities = []
+            for entity in entities:
+                if entity.offset >= part_end:
+                    break
+                entity_start = max(entity.offset, part_start)
+                entity_end = min(entity.offset + entity.length, part_end)
+                if entity_end > entity_start:
+                    part_entity = copy.copy(entity)
+                    part_entity.offset = entity_start - part_start
+                    part_entity.length = entity_end - entity_start
+                    part_entities.append(part_entity)
+            yield text[start:end], part_entities
+        start = cut
+        while start < len(text) and text[start].isspace():
+            start += 1
+
+def send_progress(message, user_id, pair_name):
+    """Return the (account, message) parts of a message already sent for a pair.
+
+    Kept on the message, so a retry or a requeue after a flood wait resumes
+    after the last part sent instead of sending the earlier parts again.
+    """
+    progress = getattr(message, '_send_progress', None)
+    if progress is None:
+        progress = message._send_progress = {}
+    return progress.setdefault((user_id, pair_name), [])
+
+def clear_send_progress(message, user_id, pair_name):
+    getattr(message, '_send_progress', {}).pop((user_id, pair_name), None)
 
-async def send_split_message(client, entity, message_text, reply_to=None, silent=False, entities=None):
-    """Send long messages by splitting them into parts."""
-    if len(message_text) <= MAX_MESSAGE_LENGTH:
-        return await client.send_message(
+async def send_split_message(client, entity, message_text, reply_to=None, silent=False, entities=None, sent=None, offset=0):
+    """Send a message in parts of at most MAX_MESSAGE_LENGTH UTF-16 units; returns the first part sent.
+
+    Parts are appended to `sent` as (account, message), starting at index
+    `offset`; parts already there are skipped.
+    """
+    sent = [] if sent is None else sent
+    parts = list(split_text(message_text, entities, MAX_MESSAGE_LENGTH))
+    for part, part_entities in parts[len(sent) - offset:]:
+        await throttle(entity, client)
+        sent_message = await client.send_message(
             entity=entity,
-            message=message_text,
-            reply_to=reply_to,
+            message=part,
+            reply_to=reply_to if len(sent) == offset else None,
             silent=silent,
-            formatting_entities=entities if entities else None
+            formatting_entities=part_entities if part_entities else None
         )
-    parts = [message_text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(message_text), MAX_MESSAGE_LENGTH)]
-    sent_messages = []
-    for part in parts:
-        sent_msg = await client.send_message(
+        sent.append((account_name(client), sent_message))
+    return sent[offset][1] if len(sent) > offset else None
+
+async def send_media_message(client, entity, media, caption, reply_to=None, silent=False, entities=None, sent=None):
+    """Send media with its caption; a caption over MAX_CAPTION_LENGTH follows as a separate text message.
+
+    Like send_split_message, parts already in `sent` are skipped.
+    """
+    sent = [] if sent is None else sent
+    caption_fits = utf16_len(caption) <= MAX_CAPTION_LENGTH
+    if not sent:
+        await throttle(entity, client)
+        sent_message = await client.send_message(
             entity=entity,
-            message=part,
-            reply_to=reply_to if not sent_messages else None,
+            file=media,
+            message=caption if caption_fits else '',
+            reply_to=reply_to,
             silent=silent,
-            formatting_entities=entities if entities and not sent_messages else None
+            formatting_entities=entities if entities and caption_fits else None
         )
-        sent_messages.append(sent_msg)
-        await asyncio.sleep(0.5)
-    return sent_messages[0] if sent_messages else None
+        sent.append((account_name(client), sent_message))
+    if not caption_fits:
+        await send_split_message(client, entity, caption, silent=silent, entities=entities, sent=sent, offset=1)
+    return sent[0][1]
+
+FILTER_CONFIG_KEYS = (
+    'blocked_sentences', 'blacklist', 'block_urls', 'blacklist_urls', 'header_pattern',
+    'footer_pattern', 'remove_mentions', 'custom_header', 'custom_footer'
+)
 
-async def notify_blocked(event, mapping, pair_name, reason):
+def filter_config_key(mapping):
+    """Return a hashable key identifying the text filter settings of a pair."""
+    return json.dumps([mapping.get(key) for key in FILTER_CONFIG_KEYS], sort_keys=True)
+
+def filter_message_text(message, mapping, user_id, pair_name):
+    """Run the text filter pipeline, memoized on the message per distinct filter config."""
+    cache = getattr(message, '_filter_cache', None)
+    if cache is None:
+        cache = message._filter_cache = {}
+    config_key = filter_config_key(mapping)
+    if config_key in cache:
+        return cache[config_key]
+
+    message_text = message.raw_text or ""
+    original_entities = message.entities or []
+    result = {
+        'text': message_text, 'entities': original_entities, 'edits': [],
+        'block_reason': None, 'urls_removed': False
+    }
+    cache[config_key] = result
+    if not message_text:
+        return result
+
+    compiled = get_compiled_filters(user_id, pair_name, mapping)
+    block_reason, spans = scan_text(message_text, mapping, compiled['automaton'])
+    if block_reason:
+        result['block_reason'] = block_reason
+        return result
+
+    message_text, edits = rewrite_text(
+        message_text, spans, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
+    )
+    result['text'] = message_text
+    result['edits'] = edits
+    result['urls_removed'] = any(kind == 'url_removed' for _, _, _, kind in spans)
+    if edits or mapping.get('block_urls') or mapping.get('blacklist_urls') or mapping.get('remove_mentions'):
+        result['entities'] = remap_entities(original_entities, utf16_edits(message.raw_text, edits), mapping)
+    return result
+
+def compute_image_hash(data):
+    """Decode image bytes at reduced size and return the pHash as a hex string.
+
+    pHash only looks at a 32x32 grayscale version, so JPEGs are decoded in
+    draft mode at the smallest scale that is still at least 64x64.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft('L', (64, 64))
+    return str(imagehash.phash(image))
+
+if IMAGE_HASH_EXECUTOR == "process":
+    image_hash_executor = ProcessPoolExecutor(max_workers=IMAGE_HASH_WORKERS)
+else:
+    image_hash_executor = ThreadPoolExecutor(max_workers=IMAGE_HASH_WORKERS, thread_name_prefix="image-hash")
+image_hash_slots = asyncio.Semaphore(IMAGE_HASH_MAX_INFLIGHT)
+
+async def hash_image_bytes(data):
+    """Compute an image pHash on the worker pool without blocking the event loop."""
+    async with image_hash_slots:
+        return await asyncio.get_running_loop().run_in_executor(image_hash_executor, compute_image_hash, data)
+
+def pick_hash_thumb(photo):
+    """Return the type of the smallest photo size still big enough for pHash, or None for the full image."""
+    sizes = [
+        size for size in photo.sizes
+        if isinstance(size, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive))
+        and min(size.w, size.h) >= IMAGE_HASH_MIN_THUMB
+    ]
+    if not sizes:
+        return None
+    return min(sizes, key=lambda size: size.w * size.h).type
+
+photo_hash_tasks = {}  # photo id -> in-flight hashing task
+
+async def download_photo_hash(message):
+    """Download a small thumbnail of a photo, hash it and cache the result by photo id."""
+    photo = message.photo
+    data = await client.download_media(message, bytes, thumb=pick_hash_thumb(photo))
+    image_hash = await hash_image_bytes(data)
+    message_store.put_image_hash(photo.id, image_hash)
+    return image_hash
+
+async def get_photo_hash(message):
+    """Return the pHash of a photo message, hashing each Telegram photo only once."""
+    image_hash = getattr(message, '_photo_hash', None)
+    if image_hash is not None:
+        return image_hash
+    photo_id = message.photo.id
+    image_hash = message_store.get_image_hash(photo_id)
+    if image_hash is None:
+        task = photo_hash_tasks.get(photo_id)
+        if task is None:
+            task = photo_hash_tasks[photo_id] = asyncio.ensure_future(download_photo_hash(message))
+            task.add_done_callback(lambda _: photo_hash_tasks.pop(photo_id, None))
+        image_hash = await asyncio.shield(task)
+    message._photo_hash = image_hash
+    return image_hash
+
+async def notify_blocked(message, mapping, pair_name, reason):
     """Notify the owner when a message is blocked."""
     if NOTIFY_CHAT_ID:
-        msg_id = getattr(event.message, 'id', 'Unknown')
-        await client.send_message(
-            NOTIFY_CHAT_ID,
-            f"ðŸš« Message blocked in pair '{pair_name}' from '{mapping['source']}'.\n"
-            f"ðŸ“„ Reason: {reason}\nðŸ†” Source Message ID: {msg_id}"
-        )
+        msg_id = getattr(message, 'id', 'Unknown')
+        try:
+            await throttle(NOTIFY_CHAT_ID)
+            await client.send_message(
+                NOTIFY_CHAT_ID,
+                f"ðŸš« Message blocked in pair '{pair_name}' from '{mapping['source']}'.\n"
+                f"ðŸ“„ Reason: {reason}\nðŸ†” Source Message ID: {msg_id}"
+            )
+        except errors.RPCError as e:
+            # A failed notification must not fail (and requeue) the job it reports on
+            logger.warning(f"Could not send block notification for pair '{pair_name}': {e}")
 
 # Core Functions
-async def forward_message_with_retry(event, mapping, user_id, pair_name):
+async def forward_message_with_retry(message, mapping, user_id, pair_name):
     """Forward a message with retries, filtering, and error handling."""
-    source_msg_id = event.message.id if hasattr(event.message, 'id') else "Unknown"
+    source_msg_id = message.id if hasattr(message, 'id') else "Unknown"
     for attempt in range(MAX_RETRIES):
         try:
             start_time = datetime.now()
-            message_text = event.message.raw_text or ""
-            text_lower = message_text.lower()  # Convert once and reuse
-            original_entities = event.message.entities or []
-            media = event.message.media
-            reply_to = await handle_reply_mapping(event, mapping)
-
-            if message_text:
-                # Blocked sentences check with regex
-                compiled_blocked = compile_blocked_sentences(mapping.get('blocked_sentences'))
-                should_block, matching_sentence = check_blocked_sentences_fast(text_lower, compiled_blocked)
-                if should_block:
-                    reason = f"Blocked sentence match: '{matching_sentence}'"
-                    await notify_blocked(event, mapping, pair_name, reason)
-                    pair_stats[user_id][pair_name]['blocked'] += 1
-                    return True
-
-                # Blacklist filtering with Aho-Corasick
-                if mapping.get('blacklist'):
-                    automaton = build_blacklist_trie(mapping['blacklist'])
-                    message_text, found = filter_text_with_blacklist(message_text, automaton)
-                    if found and message_text.strip() == "***":
-                        reason = "Entire message blacklisted"
-                        await notify_blocked(event, mapping, pair_name, reason)
-                        pair_stats[user_id][pair_name]['blocked'] += 1
-                        return True
-
-                # URL filtering
-                if mapping.get('block_urls', False) or mapping.get('blacklist_urls'):
-                    original_text = message_text
-                    message_text, allow_preview = filter_urls(
-                        message_text,
-                        mapping.get('block_urls', False),
-                        mapping.get('blacklist_urls')
-                    )
-                    if message_text != original_text:
-                        original_entities = None
-                        if mapping.get('block_urls', False):
-                            await notify_blocked(event, mapping, pair_name, "URLs removed due to block_urls setting")
-
-                # Header/Footer removal
-                if mapping.get('header_pattern') or mapping.get('footer_pattern'):
-                    message_text = remove_header_footer(
-                        message_text, mapping.get('header_pattern', ''), mapping.get('footer_pattern', '')
-                    )
-                    if message_text != event.message.raw_text:
-                        original_entities = None
-
-                # Mention removal with entity fix
-                if mapping.get('remove_mentions', False):
-                    message_text = re.sub(r'@[a-zA-Z0-9_]+|\[([^\]]+)\]\(tg://user\?id=\d+\)', '', message_text)
-                    message_text = re.sub(r'\s+', ' ', message_text).strip()
-                    original_entities = None  # Prevent broken formatting
-
-                # Custom header/footer
-                message_text = apply_custom_header_footer(
-                    message_text, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
-                )
-                if message_text != event.message.raw_text:
-                    original_entities = None
+            media = message.media
+            reply_to = handle_reply_mapping(message, mapping)
+
+            # Text filters run once per distinct filter config and are shared across fanned-out pairs
+            result = filter_message_text(message, mapping, user_id, pair_name)
+            if result['block_reason']:
+                await notify_blocked(message, mapping, pair_name, result['block_reason'])
+                bump_stat(user_id, pair_name, 'blocked')
+                return True
+            if result['urls_removed']:
+                await notify_blocked(message, mapping, pair_name, "URLs removed due to block_urls setting")
+            message_text = result['text']
+            original_entities = result['entities']
+            sent = send_progress(message, user_id, pair_name)
 
             # Log filtering time
             filter_time = (datetime.now() - start_time).total_seconds()
@@ -260,81 +1697,80 @@ async def forward_message_with_retry(event, mapping, user_id, pair_name):
 
             if media:
                 logger.info(f"Media type: {type(media).__name__}")  # Log media type
+                async def send_media(sender):
+                    file = media if sent else (await source_media(sender, mapping, [message]))[0]
+                    return await send_media_message(
+                        sender,
+                        int(mapping['destination']),
+                        file,
+                        message_text,
+                        reply_to=reply_to,
+                        silent=message.silent,
+                        entities=original_entities,
+                        sent=sent
+                    )
                 if isinstance(media, MessageMediaPhoto):
                     if mapping.get('blocked_image_hashes'):
-                        photo = await client.download_media(event.message, bytes)
-                        image = Image.open(io.BytesIO(photo))
-                        image_hash = str(imagehash.phash(image))
-                        if image_hash in mapping['blocked_image_hashes']:
-                            reason = f"Image hash match: {image_hash}"
-                            await notify_blocked(event, mapping, pair_name, reason)
-                            pair_stats[user_id][pair_name]['blocked'] += 1
+                        image_hash = await get_photo_hash(message)
+                        reason = match_blocked_image(user_id, pair_name, mapping, image_hash)
+                        if reason:
+                            await notify_blocked(message, mapping, pair_name, reason)
+                            bump_stat(user_id, pair_name, 'blocked')
                             return True
-                    sent_message = await client.send_message(
-                        entity=int(mapping['destination']),
-                        file=media,
-                        message=message_text,
-                        reply_to=reply_to,
-                        silent=event.message.silent,
-                        formatting_entities=original_entities if original_entities else None
-                    )
+                    account, sent_message = await send_via(mapping, send_media)
                 elif isinstance(media, MessageMediaDocument):
-                    sent_message = await client.send_message(
-                        entity=int(mapping['destination']),
-                        file=media,
-                        message=message_text,
-                        reply_to=reply_to,
-                        silent=event.message.silent,
-                        formatting_entities=original_entities if original_entities else None
-                    )
+                    account, sent_message = await send_via(mapping, send_media)
                 else:
                     # Handle unsupported media types (e.g., MessageMediaWebPage, MessageMediaGame, etc.)
-                    sent_message = await client.send_message(
-                        entity=int(mapping['destination']),
-                        message=message_text,
-                        reply_to=reply_to,
-                        silent=event.message.silent,
-                        formatting_entities=original_entities if original_entities else None,
-                        link_preview=True  # Preserve previews for web pages
-                    )
+                    async def send_with_preview(sender):
+                        await throttle(mapping['destination'], sender)
+                        return await sender.send_message(
+                            entity=int(mapping['destination']),
+                            message=message_text,
+                            reply_to=reply_to,
+                            silent=message.silent,
+                            formatting_entities=original_entities if original_entities else None,
+                            link_preview=True  # Preserve previews for web pages
+                        )
+                    account, sent_message = await send_via(mapping, send_with_preview)
             else:
                 if not message_text.strip():
                     reason = "Empty message after filtering"
-                    await notify_blocked(event, mapping, pair_name, reason)
-                    pair_stats[user_id][pair_name]['blocked'] += 1
+                    await notify_blocked(message, mapping, pair_name, reason)
+                    bump_stat(user_id, pair_name, 'blocked')
                     return True
-                sent_message = await send_split_message(
-                    client,
+                account, sent_message = await send_via(mapping, lambda sender: send_split_message(
+                    sender,
                     int(mapping['destination']),
                     message_text,
                     reply_to=reply_to,
-                    silent=event.message.silent,
-                    entities=original_entities
-                )
-
-            await store_message_mapping(event, mapping, sent_message)
-            pair_stats[user_id][pair_name]['forwarded'] += 1
+                    silent=message.silent,
+                    entities=original_entities,
+                    sent=sent
+                ))
+            if sent:
+                # The copy is owned by whichever account sent its first part
+                account = sent[0][0]
+
+            await store_message_mapping(
+                message, mapping, sent_message, message_content_hash(message_text, original_entities, media), account
+            )
+            clear_send_progress(message, user_id, pair_name)
+            bump_stat(user_id, pair_name, 'forwarded')
             pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
-            logger.info(f"Message forwarded from {mapping['source']} to {mapping['destination']} (ID: {sent_message.id})")
+            logger.info(f"Message forwarded from {mapping['source']} to {mapping['destination']} (ID: {sent_message.id}, account: {account})")
             return True
 
         except errors.FloodWaitError as e:
-            wait_time = e.seconds
-            logger.warning(f"Flood wait error, sleeping for {wait_time} seconds for pair '{pair_name}' (Source Msg ID: {source_msg_id})")
-            await asyncio.sleep(wait_time)
+            logger.warning(f"Flood wait of {e.seconds} seconds for pair '{pair_name}' (Source Msg ID: {source_msg_id}); parking lane")
+            raise
         except errors.ChatWriteForbiddenError as e:
             logger.warning(f"Bot forbidden to write in {mapping['destination']}. Disabling pair '{pair_name}'.")
-            mapping['active'] = False
-            save_mappings()
-            if NOTIFY_CHAT_ID:
-                await client.send_message(NOTIFY_CHAT_ID, f"âš ï¸ Disabled pair '{pair_name}' due to write permission error.")
+            await disable_pair(mapping, pair_name, "write permission error")
             return False
         except errors.ChannelInvalidError as e:
             logger.warning(f"Invalid channel {mapping['destination']}. Disabling pair '{pair_name}'.")
-            mapping['active'] = False
-            save_mappings()
-            if NOTIFY_CHAT_ID:
-                await client.send_message(NOTIFY_CHAT_ID, f"âš ï¸ Disabled pair '{pair_name}' due to invalid channel.")
+            await disable_pair(mapping, pair_name, "invalid channel")
             return False
         except (errors.RPCError, ConnectionError) as e:
             logger.warning(f"Attempt {attempt + 1} failed for pair '{pair_name}' (Source Msg ID: {source_msg_id}): {e}")
@@ -355,187 +1791,380 @@ async def forward_message_with_retry(event, mapping, user_id, pair_name):
                 await client.send_message(NOTIFY_CHAT_ID, error_msg)
             return False
 
-async def edit_forwarded_message(event, mapping, user_id, pair_name):
-    """Edit a forwarded message when the source message is edited."""
-    try:
-        if not hasattr(client, 'forwarded_messages'):
-            client.forwarded_messages = {}
-            logger.info("Initialized missing forwarded_messages attribute.")
-        mapping_key = f"{mapping['source']}:{event.message.id}"
-        if mapping_key not in client.forwarded_messages:
-            logger.warning(f"No mapping found for message: {mapping_key}")
-            return
+async def forward_album_with_retry(album, mapping, user_id, pair_name):
+    """Forward the events of an album (same grouped_id) as a single media group."""
+    source_ids = [message.id for message in album]
+    survivors = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            if survivors is None:
+                survivors = []
+                for message in album:
+                    result = filter_message_text(message, mapping, user_id, pair_name)
+                    reason = result['block_reason']
+                    if not reason and isinstance(message.media, MessageMediaPhoto) and mapping.get('blocked_image_hashes'):
+                        image_hash = await get_photo_hash(message)
+                        reason = match_blocked_image(user_id, pair_name, mapping, image_hash)
+                    if reason:
+                        await notify_blocked(message, mapping, pair_name, reason)
+                        bump_stat(user_id, pair_name, 'blocked')
+                        continue
+                    survivors.append((message, result))
+                if not survivors:
+                    return True
+                if len(survivors) == 1:
+                    return await forward_message_with_retry(survivors[0][0], mapping, user_id, pair_name)
+                for message, result in survivors:
+                    if result['urls_removed']:
+                        await notify_blocked(message, mapping, pair_name, "URLs removed due to block_urls setting")
+
+            first = survivors[0][0]
+            # Captions too long for a media group item follow the album as text messages
+            long_captions = [
+                result for _, result in survivors if utf16_len(result['text']) > MAX_CAPTION_LENGTH
+            ]
+            sent = send_progress(first, user_id, pair_name)
+            async def send_album(sender):
+                if not sent:
+                    files = await source_media(sender, mapping, [message for message, _ in survivors])
+                    await throttle(mapping['destination'], sender)
+                    sent_messages = await sender.send_file(
+                        int(mapping['destination']),
+                        file=files,
+                        caption=['' if result in long_captions else result['text'] for _, result in survivors],
+                        formatting_entities=[
+                            [] if result in long_captions else result['entities'] or [] for _, result in survivors
+                        ],
+                        reply_to=handle_reply_mapping(first, mapping),
+                        silent=first.silent
+                    )
+                    sent.append((account_name(sender), sent_messages))
+                offset = 1
+                for result in long_captions:
+                    await send_split_message(
+                        sender, int(mapping['destination']), result['text'], silent=first.silent,
+                        entities=result['entities'], sent=sent, offset=offset
+                    )
+                    offset += len(list(split_text(result['text'], result['entities'], MAX_MESSAGE_LENGTH)))
+
+            await send_via(mapping, send_album)
+            account, sent_messages = sent[0]
+            for (message, result), sent_message in zip(survivors, sent_messages):
+                if sent_message:
+                    content_hash = message_content_hash(result['text'], result['entities'], message.media)
+                    await store_message_mapping(message, mapping, sent_message, content_hash, account)
+            clear_send_progress(first, user_id, pair_name)
+            bump_stat(user_id, pair_name, 'forwarded', len(survivors))
+            pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
+            logger.info(f"Album of {len(survivors)} forwarded from {mapping['source']} to {mapping['destination']} (Source Msg IDs: {source_ids})")
+            return True
 
-        forwarded_msg_id = client.forwarded_messages[mapping_key]
-        forwarded_msg = await client.get_messages(int(mapping['destination']), ids=forwarded_msg_id)
-        if not forwarded_msg:
-            logger.warning(f"Forwarded message {forwarded_msg_id} not found in destination {mapping['destination']}")
-            del client.forwarded_messages[mapping_key]
-            return
+        except errors.FloodWaitError as e:
+            logger.warning(f"Flood wait of {e.seconds} seconds for pair '{pair_name}' (album {source_ids}); parking lane")
+            raise
+        except errors.ChatWriteForbiddenError as e:
+            logger.warning(f"Bot forbidden to write in {mapping['destination']}. Disabling pair '{pair_name}'.")
+            await disable_pair(mapping, pair_name, "write permission error")
+            return False
+        except errors.ChannelInvalidError as e:
+            logger.warning(f"Invalid channel {mapping['destination']}. Disabling pair '{pair_name}'.")
+            await disable_pair(mapping, pair_name, "invalid channel")
+            return False
+        except (errors.RPCError, ConnectionError) as e:
+            logger.warning(f"Attempt {attempt + 1} failed for pair '{pair_name}' (album {source_ids}): {e}")
+            if attempt < MAX_RETRIES - 1:
+                wait_time = RETRY_DELAY * (2 ** attempt)
+                logger.info(f"Retrying in {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+            else:
+                error_msg = f"âŒ Failed to forward album for pair '{pair_name}' (Source Msg IDs: {source_ids}) after {MAX_RETRIES} attempts. Error: {e}"
+                logger.error(error_msg)
+                if NOTIFY_CHAT_ID:
+                    await client.send_message(NOTIFY_CHAT_ID, error_msg)
+                return False
+        except Exception as e:
+            error_msg = f"âš ï¸ Unexpected error forwarding album for pair '{pair_name}' (Source Msg IDs: {source_ids}): {e}"
+            logger.error(error_msg, exc_info=True)
+            if NOTIFY_CHAT_ID:
+                await client.send_message(NOTIFY_CHAT_ID, error_msg)
+            return False
 
-        message_text = event.message.raw_text or ""
-        text_lower = message_text.lower()  # Convert once and reuse
-        original_entities = event.message.entities or []
-        media = event.message.media
+def job_messages(job):
+    """Return the source messages carried by a forward, album or edit job."""
+    kind, payload = job[0], job[1]
+    return payload if kind == 'album' else [payload]
 
-        if isinstance(media, MessageMediaPhoto) and mapping.get('blocked_image_hashes'):
-            photo = await client.download_media(event.message, bytes)
-            image = Image.open(io.BytesIO(photo))
-            image_hash = str(imagehash.phash(image))
-            if image_hash in mapping['blocked_image_hashes']:
-                await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-                reason = f"Image hash match: {image_hash}"
-                await notify_blocked(event, mapping, pair_name, reason)
-                pair_stats[user_id][pair_name]['blocked'] += 1
-                pair_stats[user_id][pair_name]['deleted'] += 1
-                return
+def native_forward_ready(job):
+    """Whether a queued forward/album job can go out as a plain server-side forward.
 
-        if mapping.get('blocked_sentences'):
-            compiled_blocked = compile_blocked_sentences(mapping['blocked_sentences'])
-            should_block, matching_sentence = check_blocked_sentences_fast(text_lower, compiled_blocked)
-            if should_block:
-                await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-                reason = f"Blocked sentence match: '{matching_sentence}'"
-                await notify_blocked(event, mapping, pair_name, reason)
-                pair_stats[user_id][pair_name]['blocked'] += 1
-                pair_stats[user_id][pair_name]['deleted'] += 1
-                return
+    That is the case when the pair has native_forward on and no filter would
+    change or block any of its messages, and none of them is a reply (a
+    forwarded copy can't be threaded onto the mapped destination message).
+    """
+    kind, payload, mapping, user_id, pair_name = job[:5]
+    if kind not in ('forward', 'album') or not mapping.get('native_forward'):
+        return False
+    for message in job_messages(job):
+        if message.reply_to and message.reply_to.reply_to_msg_id:
+            return False
+        result = filter_message_text(message, mapping, user_id, pair_name)
+        if result['block_reason'] or result['urls_removed'] or result['edits']:
+            return False
+        if len(result['entities']) != len(message.entities or []):
+            return False
+    return True
 
-        if mapping.get('blacklist') and message_text:
-            automaton = build_blacklist_trie(mapping['blacklist'])
-            message_text, found = filter_text_with_blacklist(message_text, automaton)
-            if found and message_text.strip() == "***":
-                await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-                reason = "Entire message blacklisted"
-                await notify_blocked(event, mapping, pair_name, reason)
-                pair_stats[user_id][pair_name]['blocked'] += 1
-                pair_stats[user_id][pair_name]['deleted'] += 1
-                return
+async def forward_native_batch(jobs, mapping, user_id, pair_name):
+    """Forward unchanged messages with one forward request per batch, dropping the author.
 
-        if mapping.get('block_urls', False) or mapping.get('blacklist_urls'):
-            original_text = message_text
-            message_text, _ = filter_urls(
-                message_text,
-                mapping.get('block_urls', False),
-                mapping.get('blacklist_urls')
+    Falls back to the regular per-message path if the source forbids forwarding
+    or the request fails for any reason other than a flood wait. A flood wait
+    requeues the whole batch, so messages that already have a forwarded copy
+    are skipped when it runs again.
+    """
+    messages = [message for job in jobs for message in job_messages(job)]
+    forwarded = message_store.get_many(mapping['source'], [message.id for message in messages], mapping['destination'])
+    batch = []
+    for message in messages:
+        if message.id in forwarded:
+            continue
+        if isinstance(message.media, MessageMediaPhoto) and mapping.get('blocked_image_hashes'):
+            image_hash = await get_photo_hash(message)
+            reason = match_blocked_image(user_id, pair_name, mapping, image_hash)
+            if reason:
+                await notify_blocked(message, mapping, pair_name, reason)
+                bump_stat(user_id, pair_name, 'blocked')
+                continue
+        batch.append(message)
+
+    for start in range(0, len(batch), NATIVE_FORWARD_BATCH):
+        chunk = batch[start:start + NATIVE_FORWARD_BATCH]
+        async def forward_chunk(sender):
+            await throttle(mapping['destination'], sender)
+            return await sender.forward_messages(
+                int(mapping['destination']),
+                [message.id for message in chunk],
+                from_peer=int(mapping['source']),
+                silent=chunk[0].silent,
+                drop_author=True
             )
-            if message_text != original_text:
-                original_entities = None
 
-        if (mapping.get('header_pattern') or mapping.get('footer_pattern')) and message_text:
-            message_text = remove_header_footer(
-                message_text, mapping.get('header_pattern', ''), mapping.get('footer_pattern', '')
-            )
-            if message_text != event.message.raw_text:
-                original_entities = None
+        try:
+            account, sent_messages = await send_via(mapping, forward_chunk)
+        except errors.FloodWaitError:
+            raise
+        except errors.RPCError as e:
+            logger.warning(f"Native forward failed for pair '{pair_name}' ({e}); sending {len(chunk)} messages individually")
+            for message in chunk:
+                await forward_message_with_retry(message, mapping, user_id, pair_name)
+            continue
+        for message, sent_message in zip(chunk, sent_messages):
+            if sent_message:
+                result = filter_message_text(message, mapping, user_id, pair_name)
+                content_hash = message_content_hash(result['text'], result['entities'], message.media)
+                await store_message_mapping(message, mapping, sent_message, content_hash, account)
+        bump_stat(user_id, pair_name, 'forwarded', len(chunk))
+        pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
+        logger.info(f"Natively forwarded {len(chunk)} messages from {mapping['source']} to {mapping['destination']}")
+
+async def disable_pair(mapping, pair_name, reason):
+    """Deactivate a pair whose destination can no longer be written to."""
+    mapping['active'] = False
+    save_mappings()
+    rebuild_source_index()
+    if NOTIFY_CHAT_ID:
+        await client.send_message(NOTIFY_CHAT_ID, f"âš ï¸ Disabled pair '{pair_name}' due to {reason}.")
 
-        if mapping.get('remove_mentions', False) and message_text:
-            message_text = re.sub(r'@[a-zA-Z0-9_]+|\[([^\]]+)\]\(tg://user\?id=\d+\)', '', message_text)
-            message_text = re.sub(r'\s+', ' ', message_text).strip()
-            original_entities = None  # Prevent broken formatting
+async def edit_forwarded_message(message, mapping, user_id, pair_name):
+    """Edit a forwarded message when the source message is edited.
 
-        if not message_text.strip() and not media:
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-            reason = "Empty message after filtering"
-            await notify_blocked(event, mapping, pair_name, reason)
-            pair_stats[user_id][pair_name]['blocked'] += 1
-            pair_stats[user_id][pair_name]['deleted'] += 1
+    A copy that no longer exists surfaces as MessageIdInvalidError from the edit
+    itself, and edits that don't change the filtered content are skipped. The
+    copy is edited by the account that sent it.
+    """
+    forwarded_msg_id = None
+    sender = client
+    try:
+        entry = message_store.get_entry(mapping['source'], message.id, mapping['destination'])
+        if entry is None:
+            logger.warning(f"No mapping found for message: {mapping['source']}:{message.id}:{mapping['destination']}")
             return
+        forwarded_msg_id, previous_hash, account = entry
+        sender = account_client(account)
 
-        message_text = apply_custom_header_footer(
-            message_text, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
-        )
-        if message_text != event.message.raw_text:
-            original_entities = None
+        media = message.media
+
+        if isinstance(media, MessageMediaPhoto) and mapping.get('blocked_image_hashes'):
+            image_hash = await get_photo_hash(message)
+            reason = match_blocked_image(user_id, pair_name, mapping, image_hash)
+            if reason:
+                await throttle(mapping['destination'], sender)
+                await sender.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+                await notify_blocked(message, mapping, pair_name, reason)
+                bump_stat(user_id, pair_name, 'blocked')
+                bump_stat(user_id, pair_name, 'deleted')
+                return
+
+        result = filter_message_text(message, mapping, user_id, pair_name)
+        message_text = result['text']
+        original_entities = result['entities']
+        reason = result['block_reason']
+        if not reason and not message_text.strip() and not media:
+            reason = "Empty message after filtering"
+        if reason:
+            await throttle(mapping['destination'], sender)
+            await sender.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await notify_blocked(message, mapping, pair_name, reason)
+            bump_stat(user_id, pair_name, 'blocked')
+            bump_stat(user_id, pair_name, 'deleted')
+            return
 
         if isinstance(media, MessageMediaPoll):
             logger.info(f"Poll message {forwarded_msg_id} cannot be edited; deleting and resending")
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-            del client.forwarded_messages[mapping_key]
-            await forward_message_with_retry(event, mapping, user_id, pair_name)
+            await throttle(mapping['destination'], sender)
+            await sender.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            message_store.delete(mapping['source'], message.id, mapping['destination'])
+            await forward_message_with_retry(message, mapping, user_id, pair_name)
             return
 
-        await client.edit_message(
+        content_hash = message_content_hash(message_text, original_entities, media)
+        if content_hash == previous_hash:
+            logger.info(f"Edit of {mapping['source']}:{message.id} leaves forwarded message {forwarded_msg_id} unchanged; skipped")
+            return
+
+        if media and isinstance(media, (MessageMediaPhoto, MessageMediaDocument)):
+            media = (await source_media(sender, mapping, [message]))[0]
+        else:
+            media = None
+        await throttle(mapping['destination'], sender)
+        await sender.edit_message(
             entity=int(mapping['destination']),
             message=forwarded_msg_id,
             text=message_text,
-            file=media if media and isinstance(media, (MessageMediaPhoto, MessageMediaDocument)) else None,
+            file=media,
             formatting_entities=original_entities if original_entities else None
         )
-        pair_stats[user_id][pair_name]['edited'] += 1
+        message_store.put(mapping['source'], message.id, mapping['destination'], forwarded_msg_id, content_hash, account)
+        bump_stat(user_id, pair_name, 'edited')
         pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
         logger.info(f"Forwarded message {forwarded_msg_id} edited in {mapping['destination']}")
 
     except errors.MessageAuthorRequiredError:
         logger.error(f"Cannot edit message {forwarded_msg_id}: Bot must be the original author")
+    except errors.MessageNotModifiedError:
+        logger.info(f"Forwarded message {forwarded_msg_id} already up to date")
     except errors.MessageIdInvalidError:
         logger.error(f"Cannot edit message {forwarded_msg_id}: Message ID is invalid or deleted")
-        if mapping_key in client.forwarded_messages:
-            del client.forwarded_messages[mapping_key]
+        message_store.delete(mapping['source'], message.id, mapping['destination'])
     except errors.FloodWaitError as e:
-        logger.warning(f"Flood wait error while editing, sleeping for {e.seconds} seconds...")
-        await asyncio.sleep(e.seconds)
+        logger.warning(f"Flood wait of {e.seconds} seconds while editing for pair '{pair_name}'; parking lane")
+        session_pool.flood(account_name(sender), e.seconds)
+        raise
     except Exception as e:
         logger.error(f"Error editing forwarded message {forwarded_msg_id}: {e}")
 
-async def delete_forwarded_message(event, mapping, user_id, pair_name):
-    """Delete a forwarded message when the source message is deleted."""
-    try:
-        if not hasattr(client, 'forwarded_messages'):
-            client.forwarded_messages = {}
-            logger.info("Initialized missing forwarded_messages attribute.")
-        mapping_key = f"{mapping['source']}:{event.message.id}"
-        if mapping_key not in client.forwarded_messages:
-            logger.warning(f"No mapping found for deleted message: {mapping_key}")
-            return
-
-        forwarded_msg_id = client.forwarded_messages[mapping_key]
-        await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-        pair_stats[user_id][pair_name]['deleted'] += 1
-        pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
-        logger.info(f"Forwarded message {forwarded_msg_id} deleted from {mapping['destination']}")
-        del client.forwarded_messages[mapping_key]
+async def delete_forwarded_messages(source_msg_ids, mapping, user_id, pair_name):
+    """Delete the forwarded copies of deleted source messages, up to DELETE_BATCH_SIZE per request.
 
-    except errors.MessageIdInvalidError:
-        logger.warning(f"Cannot delete message {forwarded_msg_id}: Already deleted or invalid")
-        if mapping_key in client.forwarded_messages:
-            del client.forwarded_messages[mapping_key]
-    except Exception as e:
-        logger.error(f"Error deleting forwarded message: {e}")
+    Each copy is deleted by the account that sent it.
+    """
+    found = message_store.get_many(mapping['source'], source_msg_ids, mapping['destination'])
+    if len(found) < len(source_msg_ids):
+        logger.warning(
+            f"No mapping found for {len(source_msg_ids) - len(found)} deleted messages "
+            f"from {mapping['source']} in {mapping['destination']}"
+        )
+    by_account = {}
+    for source_msg_id, (forwarded_msg_id, account) in sorted(found.items()):
+        by_account.setdefault(account, []).append((source_msg_id, forwarded_msg_id))
+    chunks = [
+        (account, entries[start:start + DELETE_BATCH_SIZE])
+        for account, entries in by_account.items()
+        for start in range(0, len(entries), DELETE_BATCH_SIZE)
+    ]
+    for account, chunk in chunks:
+        sender = account_client(account)
+        forwarded_msg_ids = [forwarded_msg_id for _, forwarded_msg_id in chunk]
+        try:
+            await throttle(mapping['destination'], sender)
+            await sender.delete_messages(int(mapping['destination']), forwarded_msg_ids)
+            bump_stat(user_id, pair_name, 'deleted', len(chunk))
+            pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
+            logger.info(f"Deleted {len(chunk)} forwarded messages from {mapping['destination']}")
+        except errors.MessageIdInvalidError:
+            logger.warning(f"Cannot delete messages {forwarded_msg_ids}: Already deleted or invalid")
+        except errors.FloodWaitError as e:
+            logger.warning(f"Flood wait of {e.seconds} seconds while deleting for pair '{pair_name}'; parking lane")
+            session_pool.flood(account_name(sender), e.seconds)
+            raise
+        except Exception as e:
+            logger.error(f"Error deleting forwarded messages: {e}")
+            continue
+        for source_msg_id, _ in chunk:
+            message_store.delete(mapping['source'], source_msg_id, mapping['destination'])
 
-async def handle_reply_mapping(event, mapping):
-    """Map replies from source to destination messages."""
-    if not hasattr(event.message, 'reply_to') or not event.message.reply_to:
+def handle_reply_mapping(message, mapping):
+    """Map replies from source to destination messages using the forwarded message index."""
+    if not hasattr(message, 'reply_to') or not message.reply_to:
         return None
     try:
-        source_reply_id = event.message.reply_to.reply_to_msg_id
+        source_reply_id = message.reply_to.reply_to_msg_id
         if not source_reply_id:
             return None
-        mapping_key = f"{mapping['source']}:{source_reply_id}"
-        if hasattr(client, 'forwarded_messages') and mapping_key in client.forwarded_messages:
-            return client.forwarded_messages[mapping_key]
-        replied_msg = await client.get_messages(int(mapping['source']), ids=source_reply_id)
-        if replied_msg and replied_msg.text:
-            dest_msgs = await client.get_messages(int(mapping['destination']), search=replied_msg.text[:20], limit=5)
-            if dest_msgs:
-                return dest_msgs[0].id
+        return message_store.get(mapping['source'], source_reply_id, mapping['destination'])
     except Exception as e:
         logger.error(f"Error handling reply mapping: {e}")
     return None
 
-async def store_message_mapping(event, mapping, sent_message):
-    """Store the mapping of source message ID to forwarded message ID."""
+def message_signature(text, media):
+    """Return a comparable (text, media kind) signature used to pair up history."""
+    media_kind = type(media).__name__ if media and not isinstance(media, MessageMediaWebPage) else None
+    return (text or "").strip(), media_kind
+
+async def backfill_message_index(mapping, user_id, pair_name, limit):
+    """Pair up source and destination history to fill the forwarded message index.
+
+    Source messages are run through the pair's filters and matched in order
+    against destination messages with the same text and media kind.
+    """
+    source = int(mapping['source'])
+    destination = int(mapping['destination'])
+    source_msgs = [m async for m in client.iter_messages(source, limit=limit)][::-1]
+    dest_msgs = [m async for m in client.iter_messages(destination, limit=limit)][::-1]
+    dest_signatures = [message_signature(m.raw_text, m.media) for m in dest_msgs]
+
+    added = 0
+    j = 0
+    for source_msg in source_msgs:
+        if j >= len(dest_msgs):
+            break
+        result = filter_message_text(source_msg, mapping, user_id, pair_name)
+        if result['block_reason']:
+            continue
+        signature = message_signature(result['text'], source_msg.media)
+        for k in range(j, min(j + BACKFILL_MAP_WINDOW, len(dest_msgs))):
+            if dest_signatures[k] == signature and dest_msgs[k].date >= source_msg.date:
+                if message_store.get(source, source_msg.id, destination) is None:
+                    message_store.put(source, source_msg.id, destination, dest_msgs[k].id)
+                    added += 1
+                j = k + 1
+                break
+    message_store.flush()
+    logger.info(f"Backfilled {added} message mappings for pair '{pair_name}' from {len(source_msgs)} source messages")
+    return added
+
+def message_content_hash(text, entities, media):
+    """Return a stable 64-bit hash of what a forwarded copy shows: filtered text, entities and media."""
+    media_id = getattr(getattr(media, 'photo', None), 'id', None) or getattr(getattr(media, 'document', None), 'id', None)
+    content = repr((text, [entity.to_dict() for entity in entities or []], type(media).__name__, media_id))
+    return int.from_bytes(hashlib.blake2b(content.encode(), digest_size=8).digest(), 'big', signed=True)
+
+async def store_message_mapping(message, mapping, sent_message, content_hash=None, account=None):
+    """Store the mapping of source message ID to forwarded message ID and the account that sent it."""
     try:
-        if not hasattr(event.message, 'id'):
+        if not hasattr(message, 'id'):
             return
-        if not hasattr(client, 'forwarded_messages'):
-            client.forwarded_messages = {}
-        if len(client.forwarded_messages) >= MAX_MAPPING_HISTORY:
-            oldest_key = next(iter(client.forwarded_messages))
-            client.forwarded_messages.pop(oldest_key)
-        source_msg_id = event.message.id
-        mapping_key = f"{mapping['source']}:{source_msg_id}"
-        client.forwarded_messages[mapping_key] = sent_message.id
+        message_store.put(mapping['source'], message.id, mapping['destination'], sent_message.id, content_hash, account)
     except Exception as e:
         logger.error(f"Error storing message mapping: {e}")
 
@@ -558,13 +2187,18 @@ async def list_commands(event):
     - `/startpair <name>` - Resume a pair
     - `/clearpairs` - Remove all pairs
     - `/togglementions <name>` - Toggle mention removal
+    - `/togglenativeforward <name>` - Forward unchanged messages server-side (no re-upload)
+    - `/setaccount <name> <session|auto>` - Pin a pair to a pool account, or let the pool pick
     - `/monitor` - View pair stats
+    - `/stathistory <name> [N(h|d)]` - Hourly or daily stats history (default 24h)
     - `/status` - Check bot status
+    - `/backfillmap <name> [limit]` - Index past forwards for reply threading
 
     **ðŸ” Filters**
     - `/addblacklist <name> <word1,word2,...>` - Blacklist words
     - `/clearblacklist <name>` - Clear blacklist
     - `/showblacklist <name>` - Show blacklist
+    - `/filterstats <name>` - Show compiled filter build time and memory
     - `/toggleurlblock <name>` - Toggle URL blocking
     - `/addurlblacklist <name> <url1,url2,...>` - Blacklist specific URLs
     - `/clearurlblacklist <name>` - Clear URL blacklist
@@ -573,7 +2207,7 @@ async def list_commands(event):
     - `/clearheaderfooter <name>` - Clear header/footer
 
     **ðŸ–¼ï¸ Image Blocking**
-    - `/blockimage <name>` - Block a specific image (reply to image)
+    - `/blockimage <name> [distance]` - Block an image and near-duplicates (reply to image)
     - `/clearblockedimages <name>` - Clear blocked images
     - `/showblockedimages <name>` - Show blocked image hashes
 
@@ -593,10 +2227,34 @@ async def list_commands(event):
 async def status(event):
     """Handle the /status command to show bot status."""
     status_msg = f"ðŸ› ï¸ Bot Status\n" \
-                 f"ðŸ“¡ Connected: {'âœ…' if is_connected else 'âŒ'}\n" \
-                 f"ðŸ“¥ Queue Size: {len(message_queue)}/{MAX_QUEUE_SIZE}\n" \
-                 f"ðŸ“Š Total Pairs: {sum(len(pairs) for pairs in channel_mappings.values())}"
-    await event.reply(status_msg)
+                 f"ðŸ“¡ Connected: {'âœ…' if connected.is_set() else 'âŒ'}\n" \
+                 f"ðŸ“¥ Queue Size: {message_queue.qsize()}/{MAX_QUEUE_SIZE} (dropped: {queue_dropped})\n" \
+                 f"ðŸ“Š Total Pairs: {sum(len(pairs) for pairs in channel_mappings.values())}\n" \
+                 f"ðŸ“ˆ Loop Lag: {loop_lag['last'] * 1000:.1f} ms " \
+                 f"(avg {sum(loop_lag['samples']) / max(len(loop_lag['samples']), 1) * 1000:.1f} ms, " \
+                 f"max {loop_lag['max'] * 1000:.1f} ms)"
+    lanes = message_queue.lane_report()
+    if lanes:
+        status_msg += f"\nðŸ”— Lanes: {len(lanes)} ({len(message_queue.busy)} running)"
+        for (source, destination), depth, head_wait, avg_wait, busy in lanes[:LANE_STATUS_LIMIT]:
+            status_msg += (
+                f"\n   {source} â†’ {destination}: {depth} queued, "
+                f"head wait {head_wait:.1f}s, avg wait {avg_wait:.1f}s{' (running)' if busy else ''}"
+            )
+    if len(pool_clients) > 1:
+        status_msg += f"\nðŸ‘¥ Accounts: {len(pool_clients)} ({ACCOUNT_POLICY})"
+        for name, load, sent, flood_left in session_pool.report():
+            state = "down" if name in session_pool.down else f"{sent} sent, {load} sending"
+            if flood_left:
+                state += f", flood wait {int(flood_left)}s"
+            status_msg += f"\n   {name}: {state}"
+    parked = message_queue.parked_report()
+    if parked:
+        status_msg += f"\nâ¸ï¸ Parked destinations: {len(parked)}"
+        for destination, remaining in parked:
+            resume_at = (datetime.now() + timedelta(seconds=remaining)).strftime('%H:%M:%S')
+            status_msg += f"\n   {destination}: flood wait, resumes at {resume_at} ({int(remaining)}s)"
+    await send_split_message_event(event, status_msg)
 
 @client.on(events.NewMessage(pattern='(?i)^/monitor$'))
 async def monitor_pairs(event):
@@ -607,7 +2265,7 @@ async def monitor_pairs(event):
         return
 
     header = "ðŸ“Š Forwarding Monitor\n--------------------\n"
-    footer = f"\n--------------------\nðŸ“¥ Total Queued: {len(message_queue)}"
+    footer = f"\n--------------------\nðŸ“¥ Total Queued: {message_queue.qsize()}"
     report = []
     for pair_name, data in channel_mappings[user_id].items():
         stats = pair_stats.get(user_id, {}).get(pair_name, {
@@ -629,13 +2287,13 @@ async def monitor_pairs(event):
 
 async def send_split_message_event(event, full_message):
     """Send a long message as multiple parts in response to an event."""
-    if len(full_message) <= MAX_MESSAGE_LENGTH:
+    if utf16_len(full_message) <= MAX_MESSAGE_LENGTH:
         await event.reply(full_message)
         return
-    parts = [full_message[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(full_message), MAX_MESSAGE_LENGTH)]
+    parts = [part for part, _ in split_text(full_message, limit=MAX_MESSAGE_LENGTH - 32)]  # room for the part label
     for i, part in enumerate(parts, 1):
+        await throttle(event.chat_id)
         await event.reply(f"ðŸ“œ Part {i}/{len(parts)}\n{part}")
-        await asyncio.sleep(0.5)
 
 @client.on(events.NewMessage(pattern=r'/setpair (\S+) (\S+) (\S+)(?: (yes|no))?'))
 async def set_pair(event):
@@ -664,16 +2322,21 @@ async def set_pair(event):
         'custom_header': '',
         'custom_footer': '',
         'blocked_sentences': [],
-        'blocked_image_hashes': []
+        'blocked_image_hashes': [],
+        'image_hash_source': IMAGE_HASH_SOURCE,
+        'native_forward': False
     }
     pair_stats[user_id][pair_name] = {'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None}
+    invalidate_compiled_filters(user_id, pair_name)
     save_mappings()
+    rebuild_source_index()
+    await start_cursor(user_id, pair_name, channel_mappings[user_id][pair_name])
     await event.reply(f"âœ… Pair '{pair_name}' Added\n{source} âž¡ï¸ {destination}\nMentions: {'âœ…' if remove_mentions else 'âŒ'}")
 
-@client.on(events.NewMessage(pattern=r'/blockimage (\S+)'))
+@client.on(events.NewMessage(pattern=r'/blockimage (\S+)(?: (\d+))?'))
 async def block_image(event):
-    """Handle the /blockimage command to block an image by its hash."""
-    pair_name = event.pattern_match.group(1)
+    """Handle the /blockimage command to block an image (and near-duplicates) by its hash."""
+    pair_name, threshold = event.pattern_match.group(1), event.pattern_match.group(2)
     user_id = str(event.sender_id)
 
     if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
@@ -690,16 +2353,20 @@ async def block_image(event):
         return
 
     try:
-        photo = await client.download_media(replied_msg, bytes)
-        image = Image.open(io.BytesIO(photo))
-        image_hash = str(imagehash.phash(image))
+        image_hash = await get_photo_hash(replied_msg)
 
+        if not channel_mappings[user_id][pair_name].get('blocked_image_hashes'):
+            channel_mappings[user_id][pair_name]['image_hash_source'] = IMAGE_HASH_SOURCE
         channel_mappings[user_id][pair_name].setdefault('blocked_image_hashes', []).append(image_hash)
         channel_mappings[user_id][pair_name]['blocked_image_hashes'] = list(set(channel_mappings[user_id][pair_name]['blocked_image_hashes']))
+        if threshold is not None:
+            channel_mappings[user_id][pair_name]['image_hash_threshold'] = min(int(threshold), 64)
+        invalidate_compiled_filters(user_id, pair_name)
         save_mappings()
 
-        logger.info(f"Blocked image hash {image_hash} for pair {pair_name} by user {user_id}")
-        await event.reply(f"ðŸ–¼ï¸ Image hash {image_hash} blocked for '{pair_name}'")
+        threshold = channel_mappings[user_id][pair_name].get('image_hash_threshold', DEFAULT_IMAGE_HASH_THRESHOLD)
+        logger.info(f"Blocked image hash {image_hash} for pair {pair_name} by user {user_id} (threshold {threshold})")
+        await event.reply(f"ðŸ–¼ï¸ Image hash {image_hash} blocked for '{pair_name}' (match distance â‰¤ {threshold})")
     except Exception as e:
         logger.error(f"Error blocking image: {e}", exc_info=True)
         await event.reply(f"âŒ Error blocking image: {str(e)}")
@@ -727,6 +2394,7 @@ async def pause_pair(event):
         return
     channel_mappings[user_id][pair_name]['active'] = False
     save_mappings()
+    rebuild_source_index()
     await event.reply(f"â¸ï¸ Pair '{pair_name}' paused.")
 
 @client.on(events.NewMessage(pattern=r'/startpair (\S+)'))
@@ -739,6 +2407,8 @@ async def start_pair(event):
         return
     channel_mappings[user_id][pair_name]['active'] = True
     save_mappings()
+    rebuild_source_index()
+    await start_cursor(user_id, pair_name, channel_mappings[user_id][pair_name])  # skip what was posted while paused
     await event.reply(f"â–¶ï¸ Pair '{pair_name}' started.")
 
 @client.on(events.NewMessage(pattern=r'/clearpairs'))
@@ -746,10 +2416,14 @@ async def clear_pairs(event):
     """Handle the /clearpairs command to remove all pairs for the user."""
     user_id = str(event.sender_id)
     if user_id in channel_mappings:
+        for pair_name in channel_mappings[user_id]:
+            reset_cursor(user_id, pair_name)
         del channel_mappings[user_id]
         if user_id in pair_stats:
             del pair_stats[user_id]
+        invalidate_compiled_filters(user_id)
         save_mappings()
+        rebuild_source_index()
         await event.reply("ðŸ—‘ï¸ All pairs cleared.")
     else:
         await event.reply("âŒ No pairs to clear.")
@@ -767,6 +2441,37 @@ async def toggle_mentions(event):
     save_mappings()
     await event.reply(f"ðŸ” Mentions removal for '{pair_name}' set to {'âœ…' if not current else 'âŒ'}.")
 
+@client.on(events.NewMessage(pattern=r'/togglenativeforward (\S+)'))
+async def toggle_native_forward(event):
+    """Handle the /togglenativeforward command to toggle server-side forwarding of unchanged messages."""
+    pair_name = event.pattern_match.group(1)
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
+        await event.reply("âŒ Pair not found.")
+        return
+    current = channel_mappings[user_id][pair_name].get('native_forward', False)
+    channel_mappings[user_id][pair_name]['native_forward'] = not current
+    save_mappings()
+    await event.reply(f"ðŸ“¤ Native forwarding for '{pair_name}' set to {'âœ…' if not current else 'âŒ'}.")
+
+@client.on(events.NewMessage(pattern=r'/setaccount (\S+) (\S+)'))
+async def set_account(event):
+    """Handle the /setaccount command to pin a pair to a pool account, or unpin it with 'auto'."""
+    pair_name, account = event.pattern_match.group(1), event.pattern_match.group(2)
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
+        await event.reply("âŒ Pair not found.")
+        return
+    if account == 'auto':
+        channel_mappings[user_id][pair_name].pop('account', None)
+    elif account in pool_clients:
+        channel_mappings[user_id][pair_name]['account'] = account
+    else:
+        await event.reply(f"âŒ Unknown account. Available: {', '.join(pool_clients)}")
+        return
+    save_mappings()
+    await event.reply(f"ðŸ‘¥ Account for '{pair_name}' set to {account}.")
+
 @client.on(events.NewMessage(pattern=r'/addblacklist (\S+) (.+)'))
 async def add_blacklist(event):
     """Handle the /addblacklist command to add words to the blacklist."""
@@ -778,6 +2483,7 @@ async def add_blacklist(event):
     word_list = [word.strip() for word in words.split(',')]
     channel_mappings[user_id][pair_name]['blacklist'].extend(word_list)
     channel_mappings[user_id][pair_name]['blacklist'] = list(set(channel_mappings[user_id][pair_name]['blacklist']))
+    invalidate_compiled_filters(user_id, pair_name)
     save_mappings()
     await event.reply(f"ðŸš« Added {len(word_list)} words to blacklist for '{pair_name}'.")
 
@@ -790,6 +2496,7 @@ async def clear_blacklist(event):
         await event.reply("âŒ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['blacklist'] = []
+    invalidate_compiled_filters(user_id, pair_name)
     save_mappings()
     await event.reply(f"ðŸ—‘ï¸ Blacklist cleared for '{pair_name}'.")
 
@@ -930,6 +2637,7 @@ async def block_sentence(event):
         return
     channel_mappings[user_id][pair_name]['blocked_sentences'].append(sentence)
     channel_mappings[user_id][pair_name]['blocked_sentences'] = list(set(channel_mappings[user_id][pair_name]['blocked_sentences']))
+    invalidate_compiled_filters(user_id, pair_name)
     save_mappings()
     await event.reply(f"ðŸš« Sentence blocked for '{pair_name}': {sentence}")
 
@@ -942,6 +2650,7 @@ async def clear_blocked_sentences(event):
         await event.reply("âŒ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['blocked_sentences'] = []
+    invalidate_compiled_filters(user_id, pair_name)
     save_mappings()
     await event.reply(f"ðŸ—‘ï¸ Blocked sentences cleared for '{pair_name}'.")
 
@@ -959,6 +2668,73 @@ async def show_blocked_sentences(event):
         return
     await event.reply(f"ðŸ“‹ Blocked sentences for '{pair_name}':\n" + "\n".join(blocked_sentences))
 
+@client.on(events.NewMessage(pattern=r'/stathistory (\S+)(?: (\d+)([hd]))?'))
+async def stat_history(event):
+    """Handle the /stathistory command to show hourly or daily throughput and block rates."""
+    pair_name, amount, unit = event.pattern_match.group(1), event.pattern_match.group(2), event.pattern_match.group(3)
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
+        await event.reply("âŒ Pair not found.")
+        return
+    amount = int(amount) if amount else 24
+    bucket_hours = 24 if unit == 'd' else 1
+    flush_pair_stats()
+    since_hour = int(time.time() // 3600) // bucket_hours * bucket_hours - (amount - 1) * bucket_hours
+    history = message_store.pair_stats_history(user_id, pair_name, since_hour, bucket_hours)
+    if not history:
+        await event.reply(f"ðŸ“ˆ No history yet for '{pair_name}'.")
+        return
+    lines = [f"ðŸ“ˆ History for '{pair_name}' (per {'day' if bucket_hours == 24 else 'hour'})"]
+    for hour, counters in history:
+        seen = counters['forwarded'] + counters['blocked']
+        blocked_rate = counters['blocked'] / seen * 100 if seen else 0.0
+        label = datetime.fromtimestamp(hour * 3600).strftime('%m-%d' if bucket_hours == 24 else '%m-%d %H:00')
+        lines.append(
+            f"{label}  Fwd: {counters['forwarded']} | Edt: {counters['edited']} | Del: {counters['deleted']} | "
+            f"Blk: {counters['blocked']} ({blocked_rate:.0f}%)"
+        )
+    await send_split_message_event(event, "\n".join(lines))
+
+@client.on(events.NewMessage(pattern=r'/filterstats (\S+)'))
+async def filter_stats(event):
+    """Handle the /filterstats command to show compiled filter build time and memory."""
+    pair_name = event.pattern_match.group(1)
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
+        await event.reply("âŒ Pair not found.")
+        return
+    mapping = channel_mappings[user_id][pair_name]
+    compiled = get_compiled_filters(user_id, pair_name, mapping)
+    await event.reply(
+        f"ðŸ“‹ Compiled filters for '{pair_name}':\n"
+        f"Blocked sentences: {len(mapping.get('blocked_sentences') or [])}\n"
+        f"Blacklist words: {len(mapping.get('blacklist') or [])}\n"
+        f"Build time: {compiled['build_time'] * 1000:.1f} ms\n"
+        f"Memory: ~{compiled['memory'] / 1024:.1f} KiB\n"
+        f"Built at: {compiled['built_at']}"
+    )
+
+@client.on(events.NewMessage(pattern=r'/backfillmap (\S+)(?: (\d+))?'))
+async def backfill_map(event):
+    """Handle the /backfillmap command to index existing forwarded messages for reply threading."""
+    pair_name, limit = event.pattern_match.group(1), event.pattern_match.group(2)
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
+        await event.reply("âŒ Pair not found.")
+        return
+    limit = min(int(limit), BACKFILL_MAP_LIMIT) if limit else BACKFILL_MAP_LIMIT
+    await event.reply(f"ðŸ“¥ Backfilling message index for '{pair_name}' from the last {limit} messages...")
+
+    async def run_backfill():
+        try:
+            added = await backfill_message_index(channel_mappings[user_id][pair_name], user_id, pair_name, limit)
+            await event.reply(f"âœ… Backfill for '{pair_name}' done: {added} messages indexed.")
+        except Exception as e:
+            logger.error(f"Error backfilling message index for '{pair_name}': {e}", exc_info=True)
+            await event.reply(f"âŒ Backfill for '{pair_name}' failed: {str(e)}")
+
+    asyncio.create_task(run_backfill())
+
 @client.on(events.NewMessage(pattern=r'/clearblockedimages (\S+)'))
 async def clear_blocked_images(event):
     """Handle the /clearblockedimages command to clear blocked image hashes."""
@@ -968,6 +2744,8 @@ async def clear_blocked_images(event):
         await event.reply("âŒ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['blocked_image_hashes'] = []
+    channel_mappings[user_id][pair_name]['image_hash_source'] = IMAGE_HASH_SOURCE
+    invalidate_compiled_filters(user_id, pair_name)
     save_mappings()
     await event.reply(f"ðŸ—‘ï¸ Blocked images cleared for '{pair_name}'.")
 
@@ -983,102 +2761,472 @@ async def show_blocked_images(event):
     if not blocked_images:
         await event.reply(f"ðŸ“‹ Blocked images for '{pair_name}' is empty.")
         return
-    await event.reply(f"ðŸ“‹ Blocked image hashes for '{pair_name}':\n" + "\n".join(blocked_images))
+    threshold = channel_mappings[user_id][pair_name].get('image_hash_threshold', DEFAULT_IMAGE_HASH_THRESHOLD)
+    note = ""
+    if stale_image_hashes(channel_mappings[user_id][pair_name]):
+        note = (
+            "\n\nâš ï¸ These hashes were taken from full-size images and may miss thumbnail-hashed photos. "
+            f"Run /clearblockedimages {pair_name} and block the images again."
+        )
+    await event.reply(
+        f"ðŸ“‹ Blocked image hashes for '{pair_name}' (match distance â‰¤ {threshold}):\n" + "\n".join(blocked_images) + note
+    )
+
+def lane_key(mapping):
+    """Return the scheduler lane of a pair: its (source, destination) chat IDs."""
+    return int(mapping['source']), int(mapping['destination'])
+
+def job_record(item):
+    """Return the compact queue log record of a job: what to fetch again and which pair it is for."""
+    kind, payload, mapping, user_id, pair_name, queued_time = item
+    message_ids = payload if kind == 'delete' else [message.id for message in job_messages(item)]
+    return {
+        'kind': kind, 'chat': int(mapping['source']), 'msgs': message_ids,
+        'user': user_id, 'pair': pair_name, 't': queued_time.timestamp()
+    }
+
+async def fetch_source_messages(chat_id, message_ids):
+    """Fetch source messages by ID, 100 per request; returns {id: message} for those that still exist."""
+    found = {}
+    message_ids = sorted(set(message_ids))
+    for start in range(0, len(message_ids), 100):
+        chunk = message_ids[start:start + 100]
+        while True:
+            try:
+                messages = await client.get_messages(chat_id, ids=chunk)
+                break
+            except errors.FloodWaitError as e:
+                logger.warning(f"Flood wait of {e.seconds}s while replaying queued messages from {chat_id}")
+                await asyncio.sleep(e.seconds)
+        for message in messages:
+            if message:
+                found[message.id] = message
+    return found
+
+async def replay_queue_log():
+    """Requeue the jobs left unacknowledged by the previous run, fetching their messages again.
+
+    Jobs whose source chat can't be fetched stay unacknowledged, so the next
+    run tries them again.
+    """
+    try:
+        records = queue_log.pending()
+        if not records:
+            return
+        logger.info(f"Replaying {len(records)} queued jobs from the last run")
+        wanted = {}
+        for record in records:
+            if record['kind'] != 'delete':
+                wanted.setdefault(record['chat'], []).extend(record['msgs'])
+        fetched = {}
+        for chat_id, message_ids in wanted.items():
+            try:
+                fetched[chat_id] = await fetch_source_messages(chat_id, message_ids)
+            except (errors.RPCError, ValueError, ConnectionError) as e:
+                logger.error(f"Could not fetch queued messages from {chat_id}; leaving them for the next run: {e}")
+        replayed = 0
+        for record in records:
+            mapping = channel_mappings.get(record['user'], {}).get(record['pair'])
+            kind, payload = record['kind'], record['msgs']
+            if not mapping or not mapping.get('active'):
+                queue_log.ack(record['id'])
+                continue
+            if kind != 'delete':
+                if record['chat'] not in fetched:
+                    # Stays pending in the log; only messages known to be gone are dropped
+                    continue
+                payload = [fetched[record['chat']][i] for i in record['msgs'] if i in fetched[record['chat']]]
+                if kind == 'album' and len(payload) == 1:
+                    kind = 'forward'
+                if kind != 'album':
+                    payload = payload[0] if payload else None
+            if not payload:
+                queue_log.ack(record['id'])
+                continue
+            queued_time = datetime.fromtimestamp(record['t'])
+            await message_queue.put(
+                lane_key(mapping), (kind, payload, mapping, record['user'], record['pair'], queued_time, record['id'])
+            )
+            replayed += 1
+        logger.info(f"Requeued {replayed} of {len(records)} jobs from the last run")
+    except Exception as e:
+        logger.error(f"Error replaying queue log: {e}", exc_info=True)
+    finally:
+        queue_replayed.set()
+
+async def queue_forward(chat_id, kind, payload):
+    """Queue a forward or album job on every active pair reading from a source chat."""
+    catch_up = catch_up_state.get(chat_id)
+    if catch_up:
+        await catch_up['done'].wait()  # missed messages go first
+        if job_messages((kind, payload))[0].id in catch_up['fetched']:
+            return
+    queued_time = datetime.now()
+    for user_id, pair_name, mapping in source_index.get(chat_id, []):
+        item = (kind, payload, mapping, user_id, pair_name, queued_time)
+        if not await enqueue_message(lane_key(mapping), item):
+            continue
+        advance_cursor(user_id, pair_name, mapping, max(message.id for message in job_messages(item)))
+        bump_stat(user_id, pair_name, 'queued')
+        logger.info(f"{kind.capitalize()} queued for '{pair_name}' at {queued_time.isoformat()}")
+
+catch_up_state = {}  # source chat id -> {'done': Event, 'fetched': message IDs} of its latest catch-up
+catch_up_wanted = asyncio.Event()  # set on startup and on every reconnect
+
+def group_albums(messages):
+    """Split messages in ID order into forward and album jobs, as (kind, payload) pairs."""
+    groups = []
+    for message in messages:
+        if (
+            message.grouped_id and groups and groups[-1][-1].grouped_id == message.grouped_id
+            and len(groups[-1]) < ALBUM_MAX_SIZE
+        ):
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return [('album', group) if len(group) > 1 else ('forward', group[0]) for group in groups]
+
+async def catch_up_source(chat_id, routes):
+    """Queue the messages a source chat received since each of its pairs last queued one.
+
+    Only the newest CATCH_UP_MAX_MESSAGES are fetched. Messages already
+    forwarded or still waiting in the queue log are skipped. Returns the
+    number of jobs queued.
+    """
+    for user_id, pair_name, mapping in routes:
+        if (user_id, pair_name) not in pair_cursors:
+            await start_cursor(user_id, pair_name, mapping)
+    routes = [route for route in routes if (route[0], route[1]) in pair_cursors]
+    if not routes:
+        return 0
+    min_id = min(pair_cursors[(user_id, pair_name)] for user_id, pair_name, _ in routes)
+    messages = [
+        message async for message in client.iter_messages(chat_id, min_id=min_id, limit=CATCH_UP_MAX_MESSAGES)
+    ][::-1]
+    catch_up_state[chat_id]['fetched'] = {message.id for message in messages}
+    if len(messages) >= CATCH_UP_MAX_MESSAGES:
+        logger.warning(f"Catch-up of {chat_id} reached {CATCH_UP_MAX_MESSAGES} messages; older missed messages are skipped")
+    pending = {
+        message_id for record in queue_log.pending()
+        if record['chat'] == chat_id and record['kind'] in ('forward', 'album') for message_id in record['msgs']
+    }
+    messages = [message for message in messages if not message.action and message.id not in pending]
+    forwarded = {
+        (user_id, pair_name): message_store.get_many(chat_id, [message.id for message in messages], mapping['destination'])
+        for user_id, pair_name, mapping in routes
+    }
+
+    queued = 0
+    queued_time = datetime.now()
+    # Jobs are interleaved across pairs so every destination lane starts catching up at once
+    for kind, payload in group_albums(messages):
+        for user_id, pair_name, mapping in routes:
+            cursor = pair_cursors[(user_id, pair_name)]
+            job_ids = [message.id for message in job_messages((kind, payload))]
+            if job_ids[-1] <= cursor or all(i in forwarded[(user_id, pair_name)] for i in job_ids):
+                continue
+            item = (kind, payload, mapping, user_id, pair_name, queued_time)
+            job_id = queue_log.add(job_record(item))
+            await message_queue.put_low(lane_key(mapping), item + (job_id,))
+            advance_cursor(user_id, pair_name, mapping, job_ids[-1])
+            bump_stat(user_id, pair_name, 'queued')
+            queued += 1
+    if queued:
+        logger.info(f"Catch-up queued {queued} jobs from {len(messages)} missed messages of {chat_id}")
+    return queued
+
+def begin_catch_up():
+    """Hold live messages of every source chat until its next catch-up is queued.
+
+    Called before the client starts and on every reconnect, so no live message
+    can move a pair's cursor past the gap before the catch-up reads it. A hold
+    still waiting for its catch-up is kept, so nothing waiting on it is lost.
+    """
+    for chat_id in source_index:
+        state = catch_up_state.get(chat_id)
+        if state is None or state['done'].is_set():
+            catch_up_state[chat_id] = {'done': asyncio.Event(), 'fetched': set()}
+
+async def catch_up():
+    """Queue what every source chat received while the bot was down or disconnected.
+
+    Live messages of a source chat wait until its catch-up is queued, so lane
+    order is kept; catch-up jobs only fill the queue up to CATCH_UP_QUEUE_SHARE.
+    """
+    begin_catch_up()
+    sources = dict(source_index)
+    for chat_id, state in catch_up_state.items():
+        if chat_id not in sources:
+            state['done'].set()  # no longer a source; release anything held for it
+
+    async def run(chat_id, routes):
+        try:
+            return await catch_up_source(chat_id, routes)
+        except Exception as e:
+            logger.error(f"Catch-up of {chat_id} failed: {e}", exc_info=True)
+            return 0
+        finally:
+            catch_up_state[chat_id]['done'].set()
+
+    queued = await asyncio.gather(*(run(chat_id, routes) for chat_id, routes in sources.items()))
+    logger.info(f"Catch-up done: {sum(queued)} jobs queued across {len(sources)} source chats")
+
+async def run_catch_ups():
+    """Run a catch-up after the queue log replay and whenever one is requested; requests made meanwhile are coalesced."""
+    await queue_replayed.wait()
+    while True:
+        await catch_up_wanted.wait()
+        catch_up_wanted.clear()
+        await catch_up()
+
+album_buffers = {}  # source chat id -> {'grouped_id', 'messages', 'timer'} of the album being collected
+
+async def flush_album(chat_id):
+    """Queue the album buffered for a source chat, if any."""
+    album = album_buffers.pop(chat_id, None)
+    if not album:
+        return
+    if album['timer']:
+        album['timer'].cancel()
+    album_messages = sorted(album['messages'], key=lambda message: message.id)
+    try:
+        if len(album_messages) == 1:
+            await queue_forward(chat_id, 'forward', album_messages[0])
+        else:
+            await queue_forward(chat_id, 'album', album_messages)
+    except Exception as e:
+        logger.error(f"Error queueing album {album['grouped_id']} from {chat_id}: {e}")
 
 @client.on(events.NewMessage)
 async def forward_messages(event):
-    """Handle new messages and queue them for forwarding."""
-    queued_time = datetime.now()
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['active'] and event.chat_id == int(mapping['source']):
-                message_queue.append((event, mapping, user_id, pair_name, queued_time))
-                pair_stats[user_id][pair_name]['queued'] += 1
-                logger.info(f"Message queued for '{pair_name}' at {queued_time.isoformat()}")
-                return
+    """Handle new messages and queue them for forwarding; album parts are buffered and sent together."""
+    if not source_index.get(event.chat_id):
+        return
+    grouped_id = event.message.grouped_id
+    album = album_buffers.get(event.chat_id)
+    if album and album['grouped_id'] != grouped_id:
+        # Keep lane order: an album must be queued before anything posted after it
+        await flush_album(event.chat_id)
+        album = None
+    if not grouped_id:
+        await queue_forward(event.chat_id, 'forward', event.message)
+        return
+    if album is None:
+        album = album_buffers[event.chat_id] = {'grouped_id': grouped_id, 'messages': [], 'timer': None}
+    album['messages'].append(event.message)
+    if album['timer']:
+        album['timer'].cancel()
+    if len(album['messages']) >= ALBUM_MAX_SIZE:
+        await flush_album(event.chat_id)
+        return
+    album['timer'] = asyncio.get_running_loop().call_later(
+        ALBUM_WINDOW, lambda: asyncio.ensure_future(flush_album(event.chat_id))
+    )
 
 @client.on(events.MessageEdited)
 async def handle_message_edit(event):
-    """Handle edited messages and update forwarded copies."""
-    if not is_connected:
+    """Handle edited messages and queue updates of forwarded copies after EDIT_DEBOUNCE."""
+    if not source_index.get(event.chat_id):
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['active'] and event.chat_id == int(mapping['source']):
-                try:
-                    await edit_forwarded_message(event, mapping, user_id, pair_name)
-                except Exception as e:
-                    logger.error(f"Error editing for '{pair_name}': {e}")
-                return
+    if not connected.is_set():
+        offline_events.append(('edit', event.message))
+        return
+    note_edit(event.message)
+
+def note_edit(message):
+    """Start or extend the debounce window of an edited source message.
+
+    Every edit moves the window EDIT_DEBOUNCE past itself, up to
+    EDIT_DEBOUNCE_MAX after the first edit of the burst.
+    """
+    key = (message.chat_id, message.id)
+    loop = asyncio.get_running_loop()
+    pending = pending_edits.get(key)
+    if pending is None:
+        pending = pending_edits[key] = {'message': message, 'first': loop.time(), 'timer': None}
+    else:
+        pending['timer'].cancel()
+    pending['message'] = message  # a newer version replaces the one still waiting
+    delay = min(EDIT_DEBOUNCE, pending['first'] + EDIT_DEBOUNCE_MAX - loop.time())
+    pending['timer'] = loop.call_later(max(0, delay), lambda: asyncio.ensure_future(queue_edit(key)))
+
+pending_edits = {}  # (source chat id, message id) -> {'message', 'first', 'timer'} of an edit waiting out EDIT_DEBOUNCE
+
+async def queue_edit(key):
+    """Queue the latest edit of a source message on every active pair reading from its chat."""
+    pending = pending_edits.pop(key, None)
+    if pending is None:
+        return
+    message = pending['message']
+    queued_time = datetime.now()
+    try:
+        for user_id, pair_name, mapping in source_index.get(key[0], []):
+            await enqueue_message(lane_key(mapping), ('edit', message, mapping, user_id, pair_name, queued_time))
+    except Exception as e:
+        logger.error(f"Error queueing edit of {key[0]}:{key[1]}: {e}")
 
 @client.on(events.MessageDeleted)
 async def handle_message_deleted(event):
-    """Handle deleted messages and remove forwarded copies."""
-    if not is_connected:
+    """Handle deleted messages and queue removal of forwarded copies."""
+    if not source_index.get(event.chat_id):
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['active'] and event.chat_id == int(mapping['source']):
-                try:
-                    for deleted_id in event.deleted_ids:
-                        event.message.id = deleted_id
-                        await delete_forwarded_message(event, mapping, user_id, pair_name)
-                except Exception as e:
-                    logger.error(f"Error handling deletion for '{pair_name}': {e}")
-                return
+    if not connected.is_set():
+        offline_events.append(('delete', event.chat_id, list(event.deleted_ids)))
+        return
+    await queue_delete(event.chat_id, list(event.deleted_ids))
+
+async def queue_delete(chat_id, deleted_ids):
+    """Queue removal of the forwarded copies of deleted source messages on every active pair."""
+    queued_time = datetime.now()
+    for user_id, pair_name, mapping in source_index.get(chat_id, []):
+        await enqueue_message(lane_key(mapping), ('delete', deleted_ids, mapping, user_id, pair_name, queued_time))
+
+# Connection State
+def on_connection_change(up):
+    """Track the main connection going up or down; workers and periodic checks follow the connected event."""
+    if up and not connected.is_set():
+        connected.set()
+        logger.info("ðŸ“¡ Connection established")
+        begin_catch_up()
+        catch_up_wanted.set()
+        if offline_events:
+            asyncio.ensure_future(replay_offline_events())
+    elif not up and connected.is_set():
+        connected.clear()
+        logger.warning("ðŸ“¡ Connection lost")
+
+async def replay_offline_events():
+    """Queue the edits and deletions that arrived while the connection was down, in arrival order."""
+    replayed = 0
+    while offline_events and connected.is_set():
+        event = offline_events.popleft()
+        try:
+            if event[0] == 'edit':
+                note_edit(event[1])
+            else:
+                await queue_delete(event[1], event[2])
+            replayed += 1
+        except Exception as e:
+            logger.error(f"Error replaying buffered {event[0]}: {e}")
+    logger.info(f"Replayed {replayed} edits and deletions buffered while disconnected")
 
 # Periodic Tasks
-async def check_connection_status():
-    """Periodically check and update connection status."""
-    global is_connected
-    while True:
-        current_status = client.is_connected()
-        if current_status and not is_connected:
-            is_connected = True
-            logger.info("ðŸ“¡ Connection established")
-        elif not current_status and is_connected:
-            is_connected = False
-            logger.warning("ðŸ“¡ Connection lost")
-        await asyncio.sleep(5)
+
+async def enqueue_message(lane, item):
+    """Log a job to the queue log and queue it on a scheduler lane according to QUEUE_OVERFLOW_POLICY.
+
+    Returns False if the job was dropped because the queue is full.
+    """
+    global queue_dropped, last_drop_alert
+    await queue_replayed.wait()  # jobs recovered from the last run go first
+    job_id = queue_log.add(job_record(item))
+    item = item + (job_id,)
+    if QUEUE_OVERFLOW_POLICY == "block":
+        await message_queue.put(lane, item)
+        return True
+    try:
+        message_queue.put_nowait(lane, item)
+        return True
+    except asyncio.QueueFull:
+        queue_log.ack(job_id)
+        queue_dropped += 1
+        pair_name = item[4]
+        logger.warning(f"Queue full, dropped {item[0]} job for pair '{pair_name}' (total dropped: {queue_dropped})")
+        if NOTIFY_CHAT_ID and time.time() - last_drop_alert > QUEUE_DROP_ALERT_INTERVAL:
+            last_drop_alert = time.time()
+            await client.send_message(
+                NOTIFY_CHAT_ID,
+                f"âš ï¸ Queue full ({MAX_QUEUE_SIZE}): dropping new messages. Total dropped: {queue_dropped}"
+            )
+        return False
+
+async def process_job(kind, payload, mapping, user_id, pair_name):
+    """Run one queued forward, album, edit or delete job."""
+    if kind == 'forward':
+        await forward_message_with_retry(payload, mapping, user_id, pair_name)
+    elif kind == 'album':
+        await forward_album_with_retry(payload, mapping, user_id, pair_name)
+    elif kind == 'edit':
+        await edit_forwarded_message(payload, mapping, user_id, pair_name)
+    elif kind == 'delete':
+        await delete_forwarded_messages(payload, mapping, user_id, pair_name)
 
 async def queue_worker():
-    """Process messages from the queue concurrently."""
+    """Process scheduler lanes as soon as work arrives."""
     while True:
-        if is_connected and message_queue:
-            try:
-                event, mapping, user_id, pair_name, queued_time = message_queue.popleft()
-                await forward_message_with_retry(event, mapping, user_id, pair_name)
-                await asyncio.sleep(FORWARD_DELAY)
-            except Exception as e:
-                logger.error(f"Worker error: {e}")
-        else:
-            await asyncio.sleep(1)
+        lane, job = await message_queue.get()
+        kind, payload, mapping, user_id, pair_name, queued_time, job_id = job
+        batch = [job]
+        try:
+            await connected.wait()
+            if native_forward_ready(job):
+                # Unchanged messages queued right behind this one go out in the same forward request
+                batch += message_queue.take_while(
+                    lane,
+                    lambda other: other[2] is mapping and native_forward_ready(other)
+                    and bool(job_messages(other)[0].silent) == bool(job_messages(job)[0].silent),
+                    NATIVE_FORWARD_BATCH - 1
+                )
+                await forward_native_batch(batch, mapping, user_id, pair_name)
+            elif kind == 'delete':
+                # Deletions queued right behind this one are merged into the same requests
+                batch += message_queue.take_while(
+                    lane, lambda other: other[0] == 'delete' and other[2] is mapping, MAX_QUEUE_SIZE
+                )
+                source_msg_ids = [source_msg_id for queued_job in batch for source_msg_id in queued_job[1]]
+                await delete_forwarded_messages(source_msg_ids, mapping, user_id, pair_name)
+            else:
+                await process_job(kind, payload, mapping, user_id, pair_name)
+            for queued_job in batch:
+                queue_log.ack(queued_job[6])
+        except errors.FloodWaitError as e:
+            for queued_job in reversed(batch):
+                message_queue.requeue(lane, queued_job)
+            message_queue.park(lane[1], e.seconds)
+            logger.warning(f"Parked destination {lane[1]} for {e.seconds}s; {kind} job for '{pair_name}' requeued")
+        except Exception as e:
+            logger.error(f"Worker error on lane {lane[0]} -> {lane[1]} ({kind} for '{pair_name}'): {e}")
+            for queued_job in batch:
+                queue_log.ack(queued_job[6])
+        finally:
+            message_queue.done(lane)
+
+async def measure_loop_lag():
+    """Sample how late the event loop wakes up, as a measure of blocking work on the loop."""
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.monotonic() - start - LOOP_LAG_INTERVAL)
+        loop_lag['last'] = lag
+        loop_lag['max'] = max(loop_lag['max'], lag)
+        loop_lag['samples'].append(lag)
+        if lag > 1:
+            logger.warning(f"Event loop lagged {lag:.2f}s")
 
 async def check_queue_inactivity():
     """Check for messages stuck in the queue and notify."""
     while True:
         await asyncio.sleep(60)  # Check every minute
-        if not is_connected or not NOTIFY_CHAT_ID or not message_queue:
+        oldest = message_queue.oldest()
+        if not connected.is_set() or not NOTIFY_CHAT_ID or oldest is None:
             continue
-        current_time = datetime.now()
-        for i, (event, mapping, user_id, pair_name, queued_time) in enumerate(message_queue):
-            wait_duration = (current_time - queued_time).total_seconds()
-            if wait_duration > QUEUE_INACTIVITY_THRESHOLD:
-                source_msg_id = event.message.id if hasattr(event.message, 'id') else "Unknown"
-                alert_msg = (
-                    f"â³ Queue Inactivity Alert: Message for pair '{pair_name}' "
-                    f"(Source Msg ID: {source_msg_id}) has been in queue for "
-                    f"{int(wait_duration // 60)} minutes. Queue size: {len(message_queue)}"
-                )
-                logger.warning(alert_msg)
-                await client.send_message(NOTIFY_CHAT_ID, alert_msg)
-                break  # Notify only the oldest message
+        kind, payload, mapping, user_id, pair_name, queued_time = oldest[:6]
+        wait_duration = (datetime.now() - queued_time).total_seconds()
+        if wait_duration > QUEUE_INACTIVITY_THRESHOLD:
+            source_msg_id = payload[0] if kind == 'delete' else job_messages(oldest)[0].id
+            alert_msg = (
+                f"â³ Queue Inactivity Alert: Message for pair '{pair_name}' "
+                f"(Source Msg ID: {source_msg_id}) has been in queue for "
+                f"{int(wait_duration // 60)} minutes. Queue size: {message_queue.qsize()}"
+            )
+            logger.warning(alert_msg)
+            await client.send_message(NOTIFY_CHAT_ID, alert_msg)
 
 async def check_pair_inactivity():
     """Check for inactive pairs and notify."""
     while True:
         await asyncio.sleep(300)  # Check every 5 minutes
-        if not is_connected or not NOTIFY_CHAT_ID:
+        if not connected.is_set() or not NOTIFY_CHAT_ID:
             continue
         current_time = datetime.now()
         for user_id, pairs in channel_mappings.items():
@@ -1102,12 +3250,12 @@ async def send_periodic_report():
     """Send periodic reports on pair statistics."""
     while True:
         await asyncio.sleep(21600)  # 6 hours
-        if not is_connected or not MONITOR_CHAT_ID:
+        if not connected.is_set() or not MONITOR_CHAT_ID:
             continue
         for user_id in channel_mappings:
             header = "ðŸ“Š 6-Hour Report\n--------------------\n"
             report = []
-            total_queued = len(message_queue)
+            total_queued = message_queue.qsize()
             for pair_name, data in channel_mappings[user_id].items():
                 stats = pair_stats.get(user_id, {}).get(pair_name, {
                     'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
@@ -1127,12 +3275,46 @@ async def send_periodic_report():
             except Exception as e:
                 logger.error(f"Error sending report: {e}")
 
+async def flush_message_store():
+    """Periodically flush batched message store writes and prune old mappings."""
+    last_prune = time.time()
+    last_stats_flush = time.time()
+    while True:
+        await asyncio.sleep(MESSAGE_STORE_FLUSH_INTERVAL)
+        if time.time() - last_stats_flush > STATS_FLUSH_INTERVAL:
+            last_stats_flush = time.time()
+            try:
+                flush_pair_stats()
+            except Exception as e:
+                # Must not end the loop that flushes the queue log and message store
+                logger.error(f"Error flushing pair stats: {e}", exc_info=True)
+        try:
+            queue_log.flush()
+        except OSError as e:
+            logger.error(f"Error flushing queue log: {e}")
+        try:
+            message_store.flush()
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                removed = message_store.prune()
+                if removed:
+                    logger.info(f"Pruned {removed} old forwarded message mappings")
+        except sqlite3.Error as e:
+            logger.error(f"Error flushing message store: {e}")
+
 # Main Function
 async def main():
     """Start the bot and manage periodic tasks."""
+    global message_store, queue_log
+    message_store = MessageStore(MESSAGE_STORE_FILE)
+    queue_log = QueueLog(QUEUE_LOG_FILE)
     load_mappings()
+    begin_catch_up()
     tasks = [
-        check_connection_status(),
+        persist_mappings(),
+        flush_message_store(),
+        run_catch_ups(),
+        measure_loop_lag(),
         send_periodic_report(),
         check_pair_inactivity(),
         check_queue_inactivity()
@@ -1152,22 +3334,32 @@ async def main():
             code = input("Please enter the verification code you received: ")
             await client.sign_in(phone=phone, code=code)
 
-        global is_connected, MONITOR_CHAT_ID, NOTIFY_CHAT_ID
-        is_connected = client.is_connected()
+        await start_pool_clients()
+
+        global MONITOR_CHAT_ID, NOTIFY_CHAT_ID
         MONITOR_CHAT_ID = (await client.get_me()).id
         NOTIFY_CHAT_ID = MONITOR_CHAT_ID
 
-        if is_connected:
+        if connected.is_set():
             logger.info("ðŸ“¡ Initial connection established")
         else:
             logger.warning("ðŸ“¡ Initial connection not established")
 
+        await replay_queue_log()
+        catch_up_wanted.set()
         await client.run_until_disconnected()
     except Exception as e:
         logger.error(f"âŒ Fatal error: {e}", exc_info=True)
     finally:
         logger.info("ðŸ¤– Bot is shutting down...")
-        save_mappings()
+        save_mappings_now()
+        flush_pair_stats()
+        queue_log.close()
+        message_store.close()
+        image_hash_executor.shutdown(wait=False, cancel_futures=True)
+        for pool_client in pool_clients.values():
+            if pool_client is not client:
+                await pool_client.disconnect()
 
 if __name__ == "__main__":
     try: